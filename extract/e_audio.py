@@ -1,30 +1,21 @@
 import os
 import requests
+from spotify_client import SpotifyClient
 from spotify_secrets import e_secrets, l_secrets
 
 
-# Function to get Spotify access token
-def get_spotify_token(client_id, client_secret):
-    auth_url = 'https://accounts.spotify.com/api/token'
-    auth_response = requests.post(auth_url, {
-        'grant_type': 'client_credentials',
-        'client_id': client_id,
-        'client_secret': client_secret,
-    })
-    return auth_response.json().get('access_token')
-
-def get_playlist_data(token, playlist_id):
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    playlist_url = f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks'
+def get_playlist_data(client, playlist_id):
+    playlist_url = f'playlists/{playlist_id}/tracks'
     params = {
         'limit': 100,
         'offset': 0
     }
     all_tracks = []
     while True:
-        response = requests.get(playlist_url, headers=headers, params=params)
+        response = client.request(playlist_url, params=params)
+        if response is None:
+            print(f"Error: could not reach the API for playlist {playlist_id}")
+            return all_tracks
         
         # Print the raw response for debugging
         print(f"Status Code (get playlist data): {response.status_code}")
@@ -82,13 +73,13 @@ def download_preview(preview_url, track_name, folder_path):
         print(f"Error downloading {track_name}: {e}")
 
 # Function to download all 30-second previews from a playlist
-def download_playlist_previews(token, playlist_id, folder_path):
+def download_playlist_previews(client, playlist_id, folder_path):
     # Ensure the folder exists
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
 
     # Get all tracks from the playlist
-    tracks = get_playlist_data(token, playlist_id)
+    tracks = get_playlist_data(client, playlist_id)
     print(f"Total tracks in playlist: {len(tracks)}")
     # Print track name and preview URL before downloading
     for track in tracks:
@@ -105,8 +96,8 @@ def download_playlist_previews(token, playlist_id, folder_path):
 if __name__ == '__main__':
 
 
-    CLIENT_ID = l_secrets['CLIENT_ID']
-    CLIENT_SECRET = l_secrets['CLIENT_SECRET']
+    # Client with a cached token and rate budget for these credentials
+    client = SpotifyClient([l_secrets])
 
     
 
@@ -184,8 +175,5 @@ if __name__ == '__main__':
     
 
 
-    # Get Spotify access token
-    token = get_spotify_token(CLIENT_ID, CLIENT_SECRET)
-
     # Download all 30-second previews from the playlist
-    download_playlist_previews(token, PLAYLIST_ID, FOLDER_PATH)
\ No newline at end of file
+    download_playlist_previews(client, PLAYLIST_ID, FOLDER_PATH)
\ No newline at end of file
@@ -1,112 +1,124 @@
 import os
-import requests
+import json
 import pandas as pd
-from itertools import cycle
-from spotify_secrets import e_secrets, l_secrets, v_secrets
-
-# Function to get Spotify access token
-def get_spotify_token(client_id, client_secret):
-    auth_url = 'https://accounts.spotify.com/api/token'
-    auth_response = requests.post(auth_url, {
-        'grant_type': 'client_credentials',
-        'client_id': client_id,
-        'client_secret': client_secret,
-    })
-    if auth_response.status_code != 200:
-        print(f"Error getting token: {auth_response.status_code} - {auth_response.text}")
-        return None
-    return auth_response.json().get('access_token')
-
-# Function to get track preview URL from Spotify by track ID
-def get_track_preview(token, track_id):
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    track_url = f'https://api.spotify.com/v1/tracks/{track_id}'
-    response = requests.get(track_url, headers=headers)
-
-    if response.status_code == 200:
-        track_data = response.json()
-        return track_data.get('preview_url', None)
-    else:
-        print(f"Failed to fetch track {track_id}: {response.status_code} - {response.text}")
-        return None
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from spotify_client import SpotifyClient
+from response_cache import ResponseCache
+
+# The multi-id tracks endpoint accepts up to 50 IDs per request
+TRACKS_PER_REQUEST = 50
+
+
+# Function to get the preview URLs of up to 50 tracks with one request (cached tracks are not requested)
+def get_track_previews(client, track_ids):
+    tracks = client.get_many('tracks', track_ids, 'tracks')
+    if tracks is None:
+        print(f"Failed to fetch {len(track_ids)} tracks.")
+        return {}
+    return {track_id: track.get('preview_url') if track else None
+            for track_id, track in zip(track_ids, tracks)}
 
 # Function to download the 30-second preview of a track
-def download_preview(preview_url, track_id, folder_path):
-    try:
-        response = requests.get(preview_url, stream=True)
-        if response.status_code == 200:
-            # Save the file as 'id.mp3'
-            track_filename = f"{track_id}.mp3"
-            file_path = os.path.join(folder_path, track_filename)
-
-            # Write the preview file to the specified folder
-            with open(file_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        file.write(chunk)
-            print(f"Downloaded: {track_filename} to {folder_path}")
-        else:
-            print(f"Failed to download: {track_id}. HTTP Status Code: {response.status_code}")
-    except Exception as e:
-        print(f"Error downloading {track_id}: {e}")
-
-# Rotate through secrets to avoid request blocks
-def rotate_credentials():
-    credentials = [
-        (e_secrets['CLIENT_ID'], e_secrets['CLIENT_SECRET']),
-        (l_secrets['CLIENT_ID'], l_secrets['CLIENT_SECRET']),
-        (v_secrets['CLIENT_ID'], v_secrets['CLIENT_SECRET'])
-    ]
-    return cycle(credentials)
+def download_preview(session, preview_url, file_path, chunk_size=64 * 1024):
+    # Write to a temporary file first, so a partial download never looks complete
+    temp_path = file_path + '.part'
+    with session.get(preview_url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        with open(temp_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    file.write(chunk)
+    os.replace(temp_path, file_path)
+
+# Function to load the manifest of previous runs: the last status recorded for each track ID
+def load_manifest(manifest_file):
+    statuses = {}
+    if manifest_file and os.path.exists(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    statuses[entry['id']] = entry['status']
+    return statuses
 
 # Main function to process the CSV and download previews
-def download_previews_from_csv(csv_file, folder_base_path):
+def download_previews_from_csv(csv_file, folder_base_path, client, manifest_file=None, max_workers=8):
+    """
+    Downloads the preview of every track of the CSV into `folder_base_path`/<like>/<id>.mp3.
+
+    API requests go through the shared SpotifyClient (cached tokens, per-credential rate budgets) and
+    the previews are downloaded over its pooled session. Preview URLs are looked up 50 tracks per
+    request, and up to `max_workers` lookups or downloads run at the same time. Every outcome is
+    appended to `manifest_file` ('done', 'no_preview' or 'failed'). A rerun skips the tracks that are
+    done or have no preview, without checking the files on disk, and retries the failed ones.
+    """
     # Load the CSV file with track names, IDs, and labels
     df = pd.read_csv(csv_file)
+    labels = dict(zip(df['id'], df['like']))  # 'like' is the column indicating 0 or 1
+
+    # Ensure the label folders exist
+    for label in set(labels.values()):
+        os.makedirs(os.path.join(folder_base_path, str(label)), exist_ok=True)
+
+    statuses = load_manifest(manifest_file)
+    pending = [track_id for track_id in labels if statuses.get(track_id) not in ('done', 'no_preview')]
+    print(f"{len(labels) - len(pending)} tracks already handled, {len(pending)} to download")
 
-    # Rotate credentials
-    credentials_cycle = rotate_credentials()
-
-    for index, row in df.iterrows():
-        track_id = row['id']
-        label = row['like']  # Assuming 'like' is the column indicating 0 or 1
-        track_name = row['track_name']
-
-        # Determine the folder path based on the label (0 or 1)
-        folder_path = os.path.join(folder_base_path, str(label))
-        
-        # Ensure the folder exists
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
-
-        # Check if the file already exists
-        track_filename = f"{track_id}.mp3"
-        file_path = os.path.join(folder_path, track_filename)
-        
-        if os.path.exists(file_path):
-            print(f"Already downloaded: {track_filename}")
-            continue  # Skip this track if it's already downloaded
-
-        # Rotate through credentials for each request
-        client_id, client_secret = next(credentials_cycle)
-        token = get_spotify_token(client_id, client_secret)
-
-        if token:
-            preview_url = get_track_preview(token, track_id)
-
-            if preview_url:
-                print(f"Downloading preview for: {track_name} ({track_id})")
-                download_preview(preview_url, track_id, folder_path)
-            else:
-                print(f"No preview available for: {track_name} ({track_id})")
-        else:
-            print("Failed to get token. Skipping this track.")
+    manifest = open(manifest_file, 'a', encoding='utf-8') if manifest_file else None
+
+    def record(track_id, status, detail=''):
+        statuses[track_id] = status
+        if manifest:
+            manifest.write(json.dumps({'id': track_id, 'status': status, 'detail': detail}) + '\n')
+            manifest.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Look up the preview URLs, many tracks per request
+            batches = [pending[i:i + TRACKS_PER_REQUEST] for i in range(0, len(pending), TRACKS_PER_REQUEST)]
+            preview_urls = {}
+            for batch_urls in executor.map(lambda batch: get_track_previews(client, batch), batches):
+                preview_urls.update(batch_urls)
+
+            futures = {}
+            for track_id in pending:
+                if track_id not in preview_urls:
+                    record(track_id, 'failed', 'track lookup failed')
+                elif not preview_urls[track_id]:
+                    record(track_id, 'no_preview')
+                else:
+                    file_path = os.path.join(folder_base_path, str(labels[track_id]), f"{track_id}.mp3")
+                    futures[executor.submit(download_preview, client.session, preview_urls[track_id], file_path)] = track_id
+
+            # Record the downloads as they finish
+            for done, future in enumerate(as_completed(futures), start=1):
+                track_id = futures[future]
+                try:
+                    future.result()
+                    record(track_id, 'done')
+                except Exception as e:
+                    print(f"Error downloading {track_id}: {e}")
+                    record(track_id, 'failed', str(e))
+                if done % 100 == 0:
+                    print(f"Downloaded {done}/{len(futures)} previews so far...")
+    finally:
+        if manifest:
+            manifest.close()
+
+    counts = pd.Series(statuses).value_counts().to_dict()
+    print(f"Download finished: {counts}")
+    return statuses
 
 
 # Example usage
 if __name__ == "__main__":
+    from spotify_secrets import e_secrets, l_secrets, v_secrets
+
     csv_file = '/Users/elcachorrohumano/workspace/MusicNN/data/tracks_audio_features_with_names.csv'
     folder_base_path = '/Users/elcachorrohumano/workspace/MusicNN/data/audio_samples'
-    download_previews_from_csv(csv_file, folder_base_path)
+    manifest_file = '/Users/elcachorrohumano/workspace/MusicNN/data/audio_samples/manifest.jsonl'
+    response_cache_file = '/Users/elcachorrohumano/workspace/MusicNN/data/spotify_cache.sqlite'
+
+    # Share the requests over every set of credentials to avoid request blocks
+    client = SpotifyClient([e_secrets, l_secrets, v_secrets], cache=ResponseCache(response_cache_file))
+    download_previews_from_csv(csv_file, folder_base_path, client, manifest_file=manifest_file)
@@ -1,151 +1,162 @@
-import requests
+import os
+import json
+import threading
 import pandas as pd
-import time
-from requests.exceptions import ConnectTimeout, ReadTimeout, ConnectionError
-from spotify_secrets import e_secrets, l_secrets, v_secrets
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from spotify_client import SpotifyClient
+from response_cache import ResponseCache
 
+# Playlists to crawl, grouped by the value stored in the 'playlist_type' column (1 = liked, 0 = not liked)
+ids = {
+    '1': ['4wabAppNrWpfm7222qeNV9'],
+    '0': ['66jbv6VIdTAyNuGNlHhWlj', '39nFCFRtOYIRkfx0hggGHa', '6bBDGRXuUB0yj6HOGdouLc', '2EoheVFjqIxgJMb8VnDRtZ',
+          '37i9dQZF1DWVRSukIED0e9', '2AvH6y4sXfpNDOes73jyyc', '4HMZyD1pQ6MV3ZBkn9Z0RE', '37i9dQZF1DX2oVzuo0LbVg',
+          '37i9dQZF1DXdDh4h59PJIQ', '37i9dQZF1DWTkxQvqMy4WW', '37i9dQZF1DX09mi3a4Zmox', '2NyfQnbUQtpgeVb5SKIYrn',
+          '37i9dQZF1DX10zKzsJ2jva', '37i9dQZF1DWTl4y3vgJOXW', '37i9dQZF1DXdC7eRcOJUCw', '2Sxd5BovYwLgRg6KyZOTer',
+          '3OR6iGU8coLhDlVsydFqO5'],
+}
 
-import requests
-import pandas as pd
-import time
-from requests.exceptions import ConnectTimeout, ReadTimeout, ConnectionError
-from spotify_secrets import e_secrets, l_secrets, v_secrets
-
-# Function to retrieve all tracks from a playlist, handling pagination with retries and timeout
-def get_all_playlist_tracks(playlist_id, retries=5, timeout=10):
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?limit=100"
-    tracks = []
-    
+# Output CSV and the checkpoint of the crawl (one JSON object per finished playlist page)
+output_csv_file = '/Users/elcachorrohumano/workspace/MusicNN/data/tracks_audio_features.csv'
+checkpoint_file = '/Users/elcachorrohumano/workspace/MusicNN/data/tracks_audio_features_checkpoint.jsonl'
+
+# SQLite cache of the API responses, shared by the extract scripts
+response_cache_file = '/Users/elcachorrohumano/workspace/MusicNN/data/spotify_cache.sqlite'
+
+# Playlist pages hold up to 100 tracks, and the audio-features endpoint accepts up to 100 IDs per request
+PAGE_SIZE = 100
+
+# Cached playlist pages are reused for a day, then revalidated with their ETag (a 304 if unchanged)
+PLAYLIST_TTL = 24 * 3600
+
+FEATURE_COLUMNS = ['acousticness', 'danceability', 'energy', 'instrumentalness', 'key', 'liveness', 'loudness',
+                   'speechiness', 'tempo', 'valence', 'duration_ms', 'time_signature']
+
+
+# Function to get the audio features of up to 100 tracks with one request (cached tracks are not requested)
+def get_audio_features_batch(client, track_ids):
+    audio_features = client.get_many('audio-features', track_ids, 'audio_features')
+    if audio_features is None:
+        print(f"Error fetching audio features for batch")
+        return None
+    return audio_features  # Return the batch of audio features
+
+# Function to build the rows of one playlist page: its tracks joined with their audio features
+def get_page_rows(client, items, playlist_type):
+    tracks = {}
+    for item in items:
+        track = item['track']
+        if track and track['id']:  # Local files and removed tracks have no ID
+            tracks.setdefault(track['id'], track)
+    if not tracks:
+        return []
+
+    audio_features = get_audio_features_batch(client, list(tracks))
+    if audio_features is None:
+        return None
+
+    rows = []
+    # Features come back in the order of the requested IDs; a relinked track can carry a different ID
+    for (track_id, track), features in zip(tracks.items(), audio_features):
+        if features:
+            row = {'track_id': track_id,
+                   'track_name': track['name'],
+                   'artist': track['artists'][0]['name'] if track['artists'] else None}
+            row.update({column: features[column] for column in FEATURE_COLUMNS})
+            row['playlist_type'] = playlist_type
+            rows.append(row)
+    return rows
+
+# Function to load the checkpoint: the rows saved so far and where each playlist has to continue from
+def load_checkpoint(checkpoint_file):
+    """
+    Returns (rows, positions). `positions` maps a playlist ID to the URL of its next page, or None if
+    the playlist is finished. A last line cut short by an interrupted write is removed from the file,
+    so its page is fetched again and the next page saved starts on a line of its own.
+    """
+    rows, positions = [], {}
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'r+b') as f:
+            complete = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                page = json.loads(line)
+                rows.extend(page['rows'])
+                positions[page['playlist_id']] = page['next']
+                complete += len(line)
+            f.truncate(complete)
+    return rows, positions
+
+# Function to crawl one playlist page by page, from `url` on, saving every finished page
+def crawl_playlist(client, playlist_id, playlist_type, url, save_page):
+    """Returns the number of pages saved; stops at the first failed request so a rerun resumes there."""
+    pages = 0
     while url:
-        time.sleep(30)
-        try:
-            response = requests.get(url, headers=headers, timeout=timeout)
-            if response.status_code == 200:
-                data = response.json()
-                tracks.extend(data['items'])  # Add the current batch of tracks to the list
-                url = data['next']  # Get the next URL for pagination
-                print(f"Fetched {len(tracks)} tracks so far from playlist {playlist_id}")
-            else:
-                print(f"Error fetching playlist {playlist_id}: {response.status_code}")
-                break
-        except (ConnectTimeout, ReadTimeout, ConnectionError) as e:
-            if retries > 0:
-                wait_time = 2 ** (5 - retries)  # Exponential backoff
-                print(f"Error: {e}. Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-                return get_all_playlist_tracks(playlist_id, retries=retries-1)
-            else:
-                print(f"Failed to retrieve playlist {playlist_id} after several attempts.")
-                break
-    print(f'{playlist_id}: {len(tracks)} total tracks fetched.')
-    return tracks
-
-
-def get_audio_features_batch(track_ids, retries=5, timeout=10):
-    url = f"https://api.spotify.com/v1/audio-features"
-    params = {'ids': ','.join(track_ids)}  # Join up to 100 track IDs
-
-    while retries > 0:
-        try:
-            response = requests.get(url, headers=headers, params=params, timeout=timeout)
-            
-            if response.status_code == 200:
-                return response.json()['audio_features']  # Return the batch of audio features
-
-            elif response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 30))  # Fallback to 30 seconds if not specified
-                print(f"Rate limit exceeded. Waiting {retry_after} seconds before retrying...")
-                time.sleep(retry_after)
-            
-            else:
-                print(f"Error fetching audio features for batch: {response.status_code}")
-                return None
-
-        except (ConnectTimeout, ReadTimeout, ConnectionError) as e:
-            if retries > 0:
-                wait_time = 2 ** (5 - retries)  # Exponential backoff
-                print(f"Connection error: {e}. Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-                retries -= 1
-            else:
-                print(f"Failed to retrieve audio features after several attempts.")
-                return None
-    
-    return None  # If all retries failed
-
-
-# Initialize data list
-data = []
-
-# Iterate through playlist IDs in the dictionary
-for key, playlist_ids in ids.items():
-    for playlist_id in playlist_ids:
-        playlist_tracks = get_all_playlist_tracks(playlist_id)
-        if playlist_tracks:
-            track_ids_batch = []
-            for item in playlist_tracks:
-                track = item['track']
-                if track:  # Ensure track is not None
-                    track_id = track['id']
-                    if track_id:
-                        track_ids_batch.append(track_id)
-                
-                # If batch size reaches 100, fetch audio features for the batch
-                if len(track_ids_batch) == 100:
-                    time.sleep(30)
-                    audio_features = get_audio_features_batch(track_ids_batch)
-                    if audio_features:
-                        for features in audio_features:
-                            if features:
-                                track_info = {
-                                    'track_id': features['id'],
-                                    'track_name': track['name'],
-                                    'artist': track['artists'][0]['name'],
-                                    'acousticness': features['acousticness'],
-                                    'danceability': features['danceability'],
-                                    'energy': features['energy'],
-                                    'instrumentalness': features['instrumentalness'],
-                                    'key': features['key'],
-                                    'liveness': features['liveness'],
-                                    'loudness': features['loudness'],
-                                    'speechiness': features['speechiness'],
-                                    'tempo': features['tempo'],
-                                    'valence': features['valence'],
-                                    'duration_ms': features['duration_ms'],
-                                    'time_signature': features['time_signature'],
-                                    'playlist_type': key
-                                }
-                                data.append(track_info)
-                    track_ids_batch = []  # Clear batch after processing
-
-            # Process any remaining track IDs in the final batch
-            if track_ids_batch:
-                audio_features = get_audio_features_batch(track_ids_batch)
-                if audio_features:
-                    for features in audio_features:
-                        if features:
-                            track_info = {
-                                'track_id': features['id'],
-                                'track_name': track['name'],
-                                'artist': track['artists'][0]['name'],
-                                'acousticness': features['acousticness'],
-                                'danceability': features['danceability'],
-                                'energy': features['energy'],
-                                'instrumentalness': features['instrumentalness'],
-                                'key': features['key'],
-                                'liveness': features['liveness'],
-                                'loudness': features['loudness'],
-                                'speechiness': features['speechiness'],
-                                'tempo': features['tempo'],
-                                'valence': features['valence'],
-                                'duration_ms': features['duration_ms'],
-                                'time_signature': features['time_signature'],
-                                'playlist_type': key
-                            }
-                            data.append(track_info)
-
-# Create a DataFrame from the collected data
-df = pd.DataFrame(data)
-
-# Save the DataFrame to a CSV file
-df.to_csv('data/tracks_audio_features.csv', index=False)
+        data = client.get(url, ttl=PLAYLIST_TTL)
+        if data is None:
+            print(f"Error fetching playlist {playlist_id}, it will be resumed on the next run.")
+            break
+        rows = get_page_rows(client, data['items'], playlist_type)
+        if rows is None:
+            print(f"Error fetching audio features of playlist {playlist_id}, it will be resumed on the next run.")
+            break
+        save_page({'playlist_id': playlist_id, 'url': url, 'next': data['next'], 'rows': rows})
+        url = data['next']  # Get the next URL for pagination
+        pages += 1
+    print(f"{playlist_id}: {pages} pages fetched{'' if url else ', playlist finished'}.")
+    return pages
+
+# Main function to crawl every playlist of `ids` concurrently and collect the audio features of its tracks
+def crawl_audio_features(client, ids, checkpoint_file=None, max_workers=8):
+    """
+    Returns a DataFrame with one row per track found in the playlists of `ids`.
+
+    Pacing is left to the client, whose rate adapts to the 429s it gets, instead of fixed sleeps.
+    Up to `max_workers` playlists are crawled at the same time; the pages of one playlist are
+    sequential since each page gives the URL of the next. Every finished page (its rows and the URL
+    of the next page) is appended to `checkpoint_file` as one line, so an interrupted crawl resumes
+    from the first page that was not saved and no page is fetched or stored twice.
+    """
+    rows, positions = load_checkpoint(checkpoint_file)
+    if positions:
+        print(f"Resuming with {len(rows)} tracks from {len(positions)} playlists in {checkpoint_file}")
+
+    checkpoint = open(checkpoint_file, 'a', encoding='utf-8') if checkpoint_file else None
+    lock = threading.Lock()
+
+    def save_page(page):
+        with lock:
+            rows.extend(page['rows'])
+            if checkpoint:
+                checkpoint.write(json.dumps(page) + '\n')
+                checkpoint.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for playlist_type, playlist_ids in ids.items():
+                for playlist_id in playlist_ids:
+                    url = positions.get(playlist_id, f"playlists/{playlist_id}/tracks?limit={PAGE_SIZE}")
+                    if url is None:
+                        continue  # Finished in a previous run
+                    futures[executor.submit(crawl_playlist, client, playlist_id, playlist_type, url, save_page)] = playlist_id
+            for future in as_completed(futures):
+                future.result()
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+    return pd.DataFrame(rows, columns=['track_id', 'track_name', 'artist'] + FEATURE_COLUMNS + ['playlist_type'])
+
+
+if __name__ == '__main__':
+    from spotify_secrets import e_secrets, l_secrets, v_secrets
+
+    # Client shared by all requests: cached tokens, per-credential adaptive rate budgets
+    client = SpotifyClient([e_secrets, l_secrets, v_secrets], cache=ResponseCache(response_cache_file))
+    df = crawl_audio_features(client, ids, checkpoint_file=checkpoint_file)
+
+    # Save the DataFrame to a CSV file
+    df.to_csv(output_csv_file, index=False)
+    print(f"{len(df)} tracks saved to {output_csv_file}")
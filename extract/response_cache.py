@@ -0,0 +1,81 @@
+import json
+import time
+import sqlite3
+import threading
+
+# Track metadata and audio features practically never change, so they are kept for 30 days by default
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+class ResponseCache:
+    """
+    SQLite cache of Spotify API responses, shared by the threads of a SpotifyClient.
+
+    Each row holds one decoded JSON value under a key made of the endpoint and an item ID (e.g.
+    'tracks/<id>' or 'audio-features/<id>'), or of the endpoint and its query for whole pages
+    (e.g. 'playlists/<id>/tracks?limit=100&offset=100'), together with the ETag it was served
+    with and the time it was fetched. An entry older than its TTL is stale: it is not returned as
+    is, but its ETag can still be used for a conditional request.
+
+    Parameters:
+        db_file (str): Path of the SQLite database (created if missing).
+        ttl (float): Default lifetime of an entry in seconds (None to never expire).
+    """
+
+    def __init__(self, db_file, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                          'key TEXT PRIMARY KEY, body TEXT NOT NULL, etag TEXT, fetched_at REAL NOT NULL)')
+        self.conn.commit()
+
+    def _fresh(self, fetched_at, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return ttl is None or time.time() - fetched_at < ttl
+
+    def lookup(self, key, ttl=None):
+        """Returns (value, etag, fresh) for `key`, or None if it was never cached."""
+        with self.lock:
+            row = self.conn.execute('SELECT body, etag, fetched_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        body, etag, fetched_at = row
+        return json.loads(body), etag, self._fresh(fetched_at, ttl)
+
+    def get_many(self, keys, ttl=None):
+        """Returns a dict with the value of every key that is cached and fresh."""
+        values = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for i in range(0, len(keys), 500):  # Stay under SQLite's limit of bound parameters
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, body, fetched_at FROM responses WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                for key, body, fetched_at in rows:
+                    if self._fresh(fetched_at, ttl):
+                        values[key] = json.loads(body)
+        return values
+
+    def put_many(self, items, etag=None):
+        """Stores (key, value) pairs, fetched now."""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO responses (key, body, etag, fetched_at) VALUES (?, ?, ?, ?)',
+                                  [(key, json.dumps(value), etag, now) for key, value in items])
+            self.conn.commit()
+
+    def put(self, key, value, etag=None):
+        self.put_many([(key, value)], etag=etag)
+
+    def touch(self, key):
+        """Marks an entry as fetched now (after the server confirmed it has not changed)."""
+        with self.lock:
+            self.conn.execute('UPDATE responses SET fetched_at = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
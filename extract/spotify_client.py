@@ -0,0 +1,239 @@
+import time
+import threading
+import requests
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+
+# Spotify API endpoints (can point to a local stand-in server for testing)
+SPOTIFY_API = 'https://api.spotify.com/v1'
+SPOTIFY_AUTH_URL = 'https://accounts.spotify.com/api/token'
+
+
+# Function to get a Spotify access token and its lifetime in seconds
+def get_spotify_token(client_id, client_secret, auth_url=SPOTIFY_AUTH_URL, session=requests):
+    auth_response = session.post(auth_url, {
+        'grant_type': 'client_credentials',
+        'client_id': client_id,
+        'client_secret': client_secret,
+    })
+    if auth_response.status_code == 200:
+        data = auth_response.json()
+        return data.get('access_token'), data.get('expires_in', 3600)
+    else:
+        raise Exception(f"Failed to get token: {auth_response.status_code}, {auth_response.text}")
+
+
+class Credential:
+    """
+    One client ID/secret pair with its cached token and its own rate budget.
+
+    The budget is a token bucket refilled at `requests_per_second` up to `burst` requests. A 429 blocks
+    the credential until its Retry-After has passed. With `adaptive` set, the rate follows the API's
+    feedback: it grows a little after every successful request and is halved on every 429 (AIMD),
+    staying between `min_rate` and `max_rate`.
+    """
+
+    def __init__(self, client_id, client_secret, requests_per_second=5.0, burst=10, adaptive=True,
+                 min_rate=0.5, max_rate=20.0, increase=0.05):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.adaptive = adaptive
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.budget = float(burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.access_token = None
+        self.expires_at = 0.0
+        self.token_lock = threading.Lock()
+
+    def wait_time(self, now):
+        """Seconds until this credential can send a request (0 if it can send one now)."""
+        self.budget = min(self.burst, self.budget + (now - self.updated_at) * self.requests_per_second)
+        self.updated_at = now
+        blocked = max(0.0, self.blocked_until - now)
+        missing = max(0.0, (1 - self.budget) / self.requests_per_second)
+        return max(blocked, missing)
+
+    def on_success(self):
+        if self.adaptive:
+            self.requests_per_second = min(self.max_rate, self.requests_per_second + self.increase)
+
+    def on_throttle(self):
+        if self.adaptive:
+            self.requests_per_second = max(self.min_rate, self.requests_per_second / 2)
+
+
+class SpotifyClient:
+    """
+    Spotify API client shared by every extract script and by all the threads of a script.
+
+    Requests go over one pooled session and are spread over a pool of credentials. Each credential
+    caches its token until it expires and has its own rate budget; a request takes the credential
+    that can send soonest. When a credential gets a 429 it is set aside for its Retry-After and the
+    request is retried on another one, so only a thread that finds every credential blocked waits.
+
+    Parameters:
+        credentials (list): Dicts with 'CLIENT_ID' and 'CLIENT_SECRET' (the spotify_secrets format).
+        requests_per_second (float): Starting request rate allowed per credential.
+        burst (int): Number of requests a credential can send at once after being idle.
+        adaptive (bool): Adjust each credential's rate from the 429s it gets (see Credential).
+        pool_size (int): Number of connections kept open (use at least the number of threads).
+        cache (ResponseCache): Optional cache of the JSON responses (see get and get_many).
+    """
+
+    def __init__(self, credentials, api_base=SPOTIFY_API, auth_url=SPOTIFY_AUTH_URL, requests_per_second=5.0,
+                 burst=10, adaptive=True, pool_size=8, retries=5, timeout=10, cache=None):
+        self.credentials = [Credential(secrets['CLIENT_ID'], secrets['CLIENT_SECRET'], requests_per_second, burst,
+                                       adaptive=adaptive)
+                            for secrets in credentials]
+        self.api_base = api_base
+        self.auth_url = auth_url
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        """Takes one request from the budget of the credential that is available soonest."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                credential = min(self.credentials, key=lambda c: c.wait_time(now))
+                wait = credential.wait_time(now)
+                if wait == 0:
+                    credential.budget -= 1
+                    return credential
+            time.sleep(wait)
+
+    def _token(self, credential):
+        with credential.token_lock:
+            if credential.access_token is None or time.monotonic() >= credential.expires_at - 60:
+                credential.access_token, expires_in = get_spotify_token(
+                    credential.client_id, credential.client_secret, self.auth_url, self.session)
+                credential.expires_at = time.monotonic() + expires_in
+            return credential.access_token
+
+    def _invalidate(self, credential, token):
+        with credential.token_lock:
+            if credential.access_token == token:
+                credential.access_token = None
+
+    def _block(self, credential, seconds):
+        with self.lock:
+            credential.blocked_until = max(credential.blocked_until, time.monotonic() + seconds)
+            credential.on_throttle()
+
+    def _succeeded(self, credential):
+        with self.lock:
+            credential.on_success()
+
+    def request(self, path, params=None, headers=None):
+        """
+        Sends a GET to `path` (relative to the API base, or a full URL) and returns the response.
+
+        401s and 429s are retried on the next credential; None is returned after `retries` connection
+        errors or rejected tokens.
+        """
+        url = path if path.startswith('http') else f"{self.api_base}/{path}"
+        retry_count = self.retries
+
+        while retry_count > 0:
+            credential = self._acquire()
+            token = self._token(credential)
+            try:
+                response = self.session.get(url, headers={**(headers or {}), 'Authorization': f'Bearer {token}'},
+                                            params=params, timeout=self.timeout)
+            except (requests.ConnectTimeout, requests.ReadTimeout, requests.ConnectionError) as e:
+                retry_count -= 1
+                wait_time = 2 ** (self.retries - retry_count)  # Exponential backoff
+                print(f"Connection error: {e}. Retrying in {wait_time} seconds...")
+                time.sleep(wait_time)
+                continue
+
+            if response.status_code == 401:  # Invalid or expired token
+                retry_count -= 1
+                self._invalidate(credential, token)
+            elif response.status_code == 429:  # Rate limit exceeded for this credential
+                retry_after = int(response.headers.get('Retry-After', 30))
+                print(f"Rate limit exceeded for client {credential.client_id[:6]}..., "
+                      f"setting it aside for {retry_after} seconds.")
+                self._block(credential, retry_after)
+            else:
+                self._succeeded(credential)
+                return response
+
+        print(f"Failed to fetch {url} after several attempts.")
+        return None
+
+    def _cache_key(self, path, params):
+        key = path[len(self.api_base) + 1:] if path.startswith(self.api_base + '/') else path
+        if params:
+            key += ('&' if '?' in key else '?') + urlencode(sorted(params.items()))
+        return key
+
+    def get(self, path, params=None, ttl=None):
+        """
+        Returns the decoded JSON of a GET request, or None if it failed.
+
+        With a cache, a fresh entry (younger than `ttl`, or the cache's TTL) is returned without a
+        request. A stale entry is revalidated with If-None-Match when it has an ETag, and a 304
+        returns it again.
+        """
+        cached = None
+        if self.cache is not None:
+            key = self._cache_key(path, params)
+            cached = self.cache.lookup(key, ttl)
+            if cached is not None and cached[2]:
+                return cached[0]
+
+        headers = {'If-None-Match': cached[1]} if cached is not None and cached[1] else None
+        response = self.request(path, params=params, headers=headers)
+        if response is None:
+            return None
+        if response.status_code == 304 and cached is not None:
+            self.cache.touch(key)
+            return cached[0]
+        if response.status_code != 200:
+            print(f"Error fetching {path}: {response.status_code}")
+            return None
+
+        data = response.json()
+        if self.cache is not None:
+            self.cache.put(key, data, etag=response.headers.get('ETag'))
+        return data
+
+    def get_many(self, endpoint, ids, field, ttl=None):
+        """
+        Returns the items of a multi-id endpoint (e.g. 'tracks' or 'audio-features') in the order of `ids`.
+
+        `field` is the list of the response holding the items (e.g. 'tracks' or 'audio_features').
+        Items are cached one by one under '<endpoint>/<id>', so only the IDs that are not cached
+        (or are stale) are requested, in one request: callers keep `ids` within the endpoint's limit.
+        A repeated ID is requested once. Null items (unknown or unavailable IDs) are returned but not
+        cached, so they are requested again next time. Returns None if the request failed.
+        """
+        keys = [f"{endpoint}/{item_id}" for item_id in ids]
+        found = self.cache.get_many(keys, ttl) if self.cache is not None else {}
+        missing = list(dict.fromkeys(item_id for item_id, key in zip(ids, keys) if key not in found))
+
+        if missing:
+            response = self.request(endpoint, params={'ids': ','.join(missing)})
+            if response is None:
+                return None
+            if response.status_code != 200:
+                print(f"Error fetching {endpoint}: {response.status_code}")
+                return None
+            items = [(f"{endpoint}/{item_id}", item) for item_id, item in zip(missing, response.json()[field])]
+            found.update(items)
+            if self.cache is not None:
+                self.cache.put_many([(key, item) for key, item in items if item is not None])
+
+        return [found[key] for key in keys]
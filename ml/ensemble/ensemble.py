@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score, accuracy_score, log_loss
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'transform'))
+from track_index import TrackIndex
+
+# Prediction tables of each model: (validation CSV, test CSV), as written by score_cnn.py
+ensemble_dir = '/Users/elcachorrohumano/workspace/MusicNN/ml/ensemble'
+models = {
+    'cnn': (f'{ensemble_dir}/predictions_model_cnn_val.csv', f'{ensemble_dir}/predictions_model_cnn_test.csv'),
+    # Written by model_zoo.py --save-predictions
+    'tabular': (f'{ensemble_dir}/predictions_model_tabular_val.csv',
+                f'{ensemble_dir}/predictions_model_tabular_test.csv'),
+}
+
+# Probabilities are clipped to [EPS, 1 - EPS] before taking logits
+EPS = 1e-6
+
+
+# Function to convert probabilities to log-odds
+def logit(p):
+    p = np.clip(p, EPS, 1 - EPS)
+    return np.log(p) - np.log1p(-p)
+
+# Function to save predictions in the format of score_cnn.py (song_id, prediction, true_label, probability)
+def save_predictions(csv_path, song_ids, probabilities, labels=None):
+    pd.DataFrame({
+        'song_id': song_ids,
+        'prediction': (np.asarray(probabilities) >= 0.5).astype(np.int64),
+        'true_label': labels if labels is not None else -1,
+        'probability': probabilities,
+    }).to_csv(csv_path, index=False)
+
+
+class EnsembleScorer:
+    """
+    Combines the probabilities of several models (the CNN, the tabular models, ...) for any batch of songs.
+
+    Every model's probabilities are aligned on one TrackIndex (track_index.py) into a (tracks + 1,
+    models) log-odds matrix; a song a model has no prediction for gets that model's mean log-odds on
+    the fitting data. The last row holds these fallbacks: TrackIndex.positions gives -1 for unknown
+    songs, which gathers that row. fit learns the weights on
+    validation songs:
+        'stacking': logistic regression on the models' log-odds (weights and bias).
+        'blend': convex combination of the models' probabilities minimizing the log loss.
+    The ensemble probability of every indexed song is then computed once, so score() is one
+    TrackIndex.positions join and one gather for the whole batch. Predictions added after fit (e.g. of
+    the test songs) are scored with the fitted weights.
+
+    Predictions come from CSV tables (load_csv) or from models in memory (add_predictions, add_model, add_cnn).
+    """
+
+    def __init__(self):
+        self.predictions = {}
+        self.labels = {}
+        self.index = None
+        self.method = None
+
+    def add_predictions(self, name, song_ids, probabilities, labels=None):
+        """Adds (or extends) the predictions of a model; `labels` are kept to fit the weights."""
+        song_ids = np.asarray(song_ids, dtype=str)
+        table = pd.Series(np.asarray(probabilities, dtype=np.float64), index=song_ids)
+        if name in self.predictions:
+            table = pd.concat([self.predictions[name], table])
+        self.predictions[name] = table[~table.index.duplicated(keep='last')]
+        if labels is not None:
+            self.labels.update(zip(song_ids, np.asarray(labels).tolist()))
+        self.index = None
+
+    def load_csv(self, name, csv_path, with_labels=True):
+        """Adds the predictions of a CSV written by score_cnn.py (or save_predictions), and its labels if `with_labels`."""
+        table = pd.read_csv(csv_path, dtype={'song_id': str})
+        has_labels = with_labels and 'true_label' in table and (table['true_label'] >= 0).all()
+        self.add_predictions(name, table['song_id'], table['probability'], table['true_label'] if has_labels else None)
+
+    def add_model(self, name, model, X, song_ids, labels=None):
+        """Adds the predictions of a live classifier with predict_proba (e.g. a model of model_zoo.py)."""
+        self.add_predictions(name, song_ids, model.predict_proba(X)[:, 1], labels)
+
+    def add_cnn(self, name, model, dataset, device, batch_size=64):
+        """Adds the predictions of a live ImprovedCNN on a spectrogram dataset (see score_cnn.py)."""
+        sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+        from score_cnn import predict
+        _, probabilities = predict(model, dataset, device, batch_size=batch_size)
+        self.add_predictions(name, dataset.song_ids, probabilities, dataset.labels.numpy())
+
+    def _build(self):
+        self.names = list(self.predictions)
+        song_ids = np.concatenate([table.index.to_numpy() for table in self.predictions.values()])
+        self.index = TrackIndex(pd.DataFrame({'id': song_ids}))
+        # Log-odds of every model, NaN where a model has no prediction
+        self.raw_logits = np.full((len(self.index) + 1, len(self.names)), np.nan)
+        for j, name in enumerate(self.names):
+            table = self.predictions[name]
+            self.raw_logits[self.index.positions(table.index.to_numpy()), j] = logit(table.to_numpy())
+        self.logits = self.raw_logits
+        if self.method is not None:
+            self._score_all()
+
+    def _score_all(self):
+        """Fills the missing predictions with the fallbacks and computes the ensemble probability of every song."""
+        self.logits = np.where(np.isnan(self.raw_logits), self.fallback, self.raw_logits)
+        self.scores = self._combine_logits(self.logits)
+
+    def _combine_logits(self, logits):
+        if self.method == 'stacking':
+            scores = 1 / (1 + np.exp(-(logits @ self.weights + self.bias)))
+        else:
+            scores = (1 / (1 + np.exp(-logits))) @ self.weights
+        return scores.astype(np.float32)
+
+    def features(self, song_ids):
+        """Returns the (batch, models) log-odds of a batch of songs (NaN for missing predictions before fit)."""
+        if self.index is None:
+            self._build()
+        return self.logits[self.index.positions(song_ids)]
+
+    def fit(self, song_ids=None, labels=None, method='stacking', C=1.0):
+        """
+        Fits the ensemble weights on `song_ids` with `labels` (by default every song with a known label,
+        which is the validation split when the test tables have no labels).
+        """
+        if song_ids is None:
+            song_ids = np.array(list(self.labels), dtype=str)
+            labels = np.array([self.labels[song_id] for song_id in song_ids])
+        labels = np.asarray(labels)
+        if method not in ('stacking', 'blend'):
+            raise ValueError(f"Unknown ensemble method: {method}")
+        # Fallbacks: each model's mean log-odds on the fitting songs it has
+        if self.index is None:
+            self._build()
+        X = self.raw_logits[self.index.positions(song_ids)]
+        self.fallback = np.nanmean(X, axis=0)
+        X = np.where(np.isnan(X), self.fallback, X)
+
+        if method == 'stacking':
+            stacker = LogisticRegression(C=C).fit(X, labels)
+            self.weights, self.bias = stacker.coef_[0], stacker.intercept_[0]
+        else:
+            probabilities = 1 / (1 + np.exp(-X))
+            # Weights on the simplex through a softmax, so the optimization is unconstrained
+            def simplex(theta):
+                weights = np.exp(theta - theta.max())
+                return weights / weights.sum()
+            def loss(theta):
+                return log_loss(labels, np.clip(probabilities @ simplex(theta), EPS, 1 - EPS))
+            self.weights = simplex(minimize(loss, np.zeros(len(self.names)), method='L-BFGS-B').x)
+            self.bias = 0.0
+        self.method = method
+        self._score_all()
+        return {name: round(float(weight), 4) for name, weight in zip(self.names, self.weights)}
+
+    def score(self, song_ids):
+        """Returns the ensemble probability of every song of the batch."""
+        if self.index is None:
+            self._build()
+        return self.scores[self.index.positions(song_ids)]
+
+    def combine(self, probabilities):
+        """
+        Returns the ensemble probability of songs that are not indexed (e.g. scored live), from
+        {model name: probabilities of the batch}; models left out get their fallback.
+        """
+        if self.method is None:
+            raise ValueError("The ensemble weights are not fitted.")
+        unknown = [name for name in probabilities if name not in self.names]
+        if unknown:
+            raise ValueError(f"Models not in the ensemble: {unknown} (it combines {self.names})")
+        if not probabilities:
+            raise ValueError(f"No probabilities given for any model of the ensemble ({self.names})")
+        n = len(next(iter(probabilities.values())))
+        logits = np.tile(self.fallback, (n, 1))
+        for j, name in enumerate(self.names):
+            if name in probabilities:
+                logits[:, j] = logit(np.asarray(probabilities[name], dtype=np.float64))
+        return self._combine_logits(logits)
+
+
+# Function to evaluate each model and the ensemble on labeled songs
+def evaluate(scorer, song_ids, labels):
+    results = {}
+    X = scorer.features(song_ids)
+    for j, name in enumerate(scorer.names):
+        probabilities = 1 / (1 + np.exp(-X[:, j]))
+        results[name] = {'auc': roc_auc_score(labels, probabilities),
+                         'accuracy': accuracy_score(labels, probabilities >= 0.5)}
+    probabilities = scorer.score(song_ids)
+    results['ensemble'] = {'auc': roc_auc_score(labels, probabilities),
+                           'accuracy': accuracy_score(labels, probabilities >= 0.5)}
+    return pd.DataFrame(results).round(4)
+
+# Function to time score() on batches of random indexed songs
+def benchmark(scorer, batch_size=1024, repeats=200, seed=0):
+    rng = np.random.default_rng(seed)
+    batches = [rng.choice(scorer.index.ids.to_numpy(), size=batch_size) for _ in range(repeats)]
+    start = time.perf_counter()
+    for batch in batches:
+        scorer.score(batch)
+    return (time.perf_counter() - start) / (batch_size * repeats) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit ensemble weights on validation and score the test songs.")
+    parser.add_argument('--model', nargs=3, action='append', metavar=('NAME', 'VAL_CSV', 'TEST_CSV'),
+                        help="Prediction tables of a model (can be repeated). Defaults to the CNN.")
+    parser.add_argument('--method', choices=['stacking', 'blend'], default='stacking')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--save', default=None, metavar='PICKLE', help="Save the fitted scorer (e.g. for taste_service.py).")
+    args = parser.parse_args()
+
+    tables = {name: (val_csv, test_csv) for name, val_csv, test_csv in args.model} if args.model else models
+    scorer = EnsembleScorer()
+    for name, (val_csv, _) in tables.items():
+        scorer.load_csv(name, val_csv)
+    # Fit on the validation songs only, then add the test predictions (scored with the fitted weights)
+    weights = scorer.fit(method=args.method)
+    val_ids = np.array(list(scorer.labels), dtype=str)
+    val_labels = np.array([scorer.labels[song_id] for song_id in val_ids])
+    for name, (_, test_csv) in tables.items():
+        scorer.load_csv(name, test_csv, with_labels=False)
+
+    print(f"{args.method} weights: {weights}, bias {scorer.bias:.4f}")
+    print("\nValidation:")
+    print(evaluate(scorer, val_ids, val_labels))
+    test_labels = pd.concat([pd.read_csv(test_csv, dtype={'song_id': str}).set_index('song_id')['true_label']
+                             for _, test_csv in tables.values()])
+    test_labels = test_labels[~test_labels.index.duplicated()]
+    print("\nTest:")
+    print(evaluate(scorer, test_labels.index.to_numpy(), test_labels.to_numpy()))
+    print(f"\nscore(): {benchmark(scorer, batch_size=args.batch_size):.3f} us per track "
+          f"in batches of {args.batch_size}")
+    if args.save:
+        with open(args.save, 'wb') as f:
+            pickle.dump(scorer, f)
+        print(f"Scorer saved to {args.save}")
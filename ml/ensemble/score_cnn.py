@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specs'))
+from spec_dataset import open_dataset, make_loader
+from cnn_model import load_model
+
+# File paths
+model_path = '/Users/elcachorrohumano/workspace/MusicNN/ml/specs/fine_tuning/models/model_9.pth'
+splits = [
+    ('/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5',
+     '/Users/elcachorrohumano/workspace/MusicNN/ml/ensemble/predictions_model_cnn_val.csv'),
+    ('/Users/elcachorrohumano/workspace/MusicNN/data/test/spec_test.h5',
+     '/Users/elcachorrohumano/workspace/MusicNN/ml/ensemble/predictions_model_cnn_test.csv'),
+]
+
+# Parameters of the saved model (model_9 of the grid search)
+conv_channels = [32, 64, 128]
+fc_units = [1024, 512]
+dropout_rate = 0.25
+
+# Function to score every sample of a dataset in batches
+def predict(model, dataset, device, batch_size=64, num_workers=0):
+    """
+    Runs the model over a dataset and returns (predictions, probabilities) as NumPy arrays.
+
+    Batch outputs are written into preallocated arrays, so no per-row Python work is done.
+    `probabilities` is the softmax probability of class 1.
+    """
+    predictions = np.empty(len(dataset), dtype=np.int64)
+    probabilities = np.empty(len(dataset), dtype=np.float32)
+    loader = make_loader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    start = 0
+    with torch.inference_mode():
+        for inputs, _ in loader:
+            outputs = model(inputs.to(device))
+            end = start + len(outputs)
+            probabilities[start:end] = torch.softmax(outputs, dim=1)[:, 1].cpu().numpy()
+            predictions[start:end] = torch.argmax(outputs, dim=1).cpu().numpy()
+            start = end
+    return predictions, probabilities
+
+# Function to score one HDF5 split and save the predictions to CSV
+def score_split(model, data_path, output_csv_path, device, batch_size=64, num_workers=0):
+    dataset = open_dataset(data_path)
+
+    start_time = time.perf_counter()
+    predictions, probabilities = predict(model, dataset, device, batch_size=batch_size, num_workers=num_workers)
+    elapsed = time.perf_counter() - start_time
+
+    results = pd.DataFrame({
+        'song_id': dataset.song_ids,
+        'prediction': predictions,
+        'true_label': dataset.labels.numpy(),
+        'probability': probabilities,
+    })
+    results.to_csv(output_csv_path, index=False)
+
+    print(f"{data_path}: {len(dataset)} clips in {elapsed:.2f}s ({len(dataset) / elapsed:.1f} clips/s)")
+    print(f"Predictions saved to {output_csv_path}")
+    return len(dataset), elapsed
+
+# Function to load the model once and score every split
+def score_splits(model_path, splits, batch_size=64, num_threads=None, num_workers=0, device=None):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if device is None:
+        device = torch.device('mps' if torch.backends.mps.is_available() else 'cpu')
+    print("Using device:", device, f"({torch.get_num_threads()} threads)")
+
+    # Every split must have the spectrogram shape the model was built for
+    shapes = {}
+    for data_path, _ in splits:
+        shapes[data_path] = open_dataset(data_path).shape[1:]
+    if len(set(shapes.values())) > 1:
+        raise ValueError(f"All splits must have the same spectrogram shape, got {shapes}")
+    _, height, width = next(iter(shapes.values()))
+
+    model = load_model(model_path, height, width,
+                       conv_channels=conv_channels,
+                       fc_units=fc_units,
+                       dropout_rate=dropout_rate,
+                       device=device)
+
+    total_clips, total_time = 0, 0.0
+    for data_path, output_csv_path in splits:
+        n_clips, elapsed = score_split(model, data_path, output_csv_path, device,
+                                       batch_size=batch_size, num_workers=num_workers)
+        total_clips += n_clips
+        total_time += elapsed
+    print(f"Total: {total_clips} clips in {total_time:.2f}s ({total_clips / total_time:.1f} clips/s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score HDF5 spectrogram splits with the saved ImprovedCNN.")
+    parser.add_argument('--model', default=model_path, help="Path to the saved state dict.")
+    parser.add_argument('--split', nargs=2, action='append', metavar=('H5_FILE', 'OUTPUT_CSV'),
+                        help="HDF5 split (or .npy shard directory) to score and CSV to write (can be repeated). "
+                             "Defaults to validation and test.")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=None, help="Number of intra-op CPU threads.")
+    parser.add_argument('--workers', type=int, default=0, help="DataLoader worker processes prefetching batches.")
+    parser.add_argument('--device', default=None, help="Torch device (defaults to mps when available, else cpu).")
+    args = parser.parse_args()
+
+    score_splits(args.model, args.split or splits, batch_size=args.batch_size, num_threads=args.threads,
+                 num_workers=args.workers, device=args.device)
@@ -0,0 +1,387 @@
+import io
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import pickle
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import urllib.request
+import numpy as np
+import pandas as pd
+import requests
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specs'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'transform'))
+from cnn_model import load_model
+from spec_dataset import open_dataset
+from model_zoo import load_tabular_model
+from mp3_to_spec import get_spectrogram, PAD_DB
+from stream_ingest import fetch_preview
+from score_cnn import model_path, conv_channels, fc_units, dropout_rate
+
+# Tabular model saved by model_zoo.py --save, ensemble saved by ensemble.py --save (optional)
+tabular_model_path = '/Users/elcachorrohumano/workspace/MusicNN/ml/tabular_model.pkl'
+ensemble_path = None
+# Split the CNN was trained on: gives the spectrogram size it expects
+reference_data_path = '/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5'
+
+# Micro-batching of the CNN: largest batch, and longest wait for more requests after the first one
+max_batch = 16
+max_wait_ms = 5.0
+
+# Number of latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+
+
+class LatencyStats:
+    """
+    Sliding window of latencies (the last `window` ones) with their percentiles.
+
+    Parameters:
+        window (int): Number of latencies kept.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.values.append(seconds)
+            self.count += 1
+
+    def summary(self):
+        """Returns {'count', 'p50_ms', 'p99_ms'} (percentiles of the window, None before the first value)."""
+        with self.lock:
+            values = np.array(self.values)
+            count = self.count
+        if not len(values):
+            return {'count': count, 'p50_ms': None, 'p99_ms': None}
+        p50, p99 = np.percentile(values, [50, 99]) * 1000
+        return {'count': count, 'p50_ms': round(float(p50), 3), 'p99_ms': round(float(p99), 3)}
+
+
+class MicroBatcher:
+    """
+    Groups the spectrograms of concurrent requests into batches for one CNN forward pass.
+
+    Request threads call predict(), which queues the spectrogram and waits for its probability. One
+    worker thread takes the first queued spectrogram, then keeps collecting until it has `max_batch`
+    of them or `max_wait_ms` have passed since the first, and runs them through the model together.
+    A lone request waits at most `max_wait_ms`; under load the batches fill up and the model runs
+    once per batch instead of once per request.
+
+    Parameters:
+        model (nn.Module): ImprovedCNN in eval mode.
+        max_batch (int): Largest number of spectrograms per forward pass.
+        max_wait_ms (float): Longest wait for more spectrograms after the first of a batch.
+        device (str): Torch device of the model.
+    """
+
+    def __init__(self, model, max_batch=max_batch, max_wait_ms=max_wait_ms, device='cpu'):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.device = device
+        self.queue = queue.Queue()
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+        self.latency = LatencyStats()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def predict(self, spectrogram):
+        """Returns the probability of class 1 for one (height, width) spectrogram, once its batch has run."""
+        start = time.perf_counter()
+        future = Future()
+        self.queue.put((spectrogram, future))
+        probability = future.result()
+        self.latency.add(time.perf_counter() - start)
+        return probability
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop after this batch
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            futures = [future for _, future in batch]
+            try:
+                inputs = torch.from_numpy(np.stack([spectrogram for spectrogram, _ in batch])).unsqueeze(1)
+                with torch.inference_mode():
+                    probabilities = torch.softmax(self.model(inputs.to(self.device)), dim=1)[:, 1].cpu().numpy()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batch_sizes.append(len(batch))
+            for future, probability in zip(futures, probabilities):
+                future.set_result(float(probability))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class TasteService:
+    """
+    Predicts whether a track will be liked from its audio-feature row, its preview audio, or both.
+
+    The CNN, the tabular model (with its fitted FeatureEngineer) and the optional ensemble are loaded
+    once and kept in memory. Audio is decoded into a spectrogram on the request's thread, cut or padded
+    with PAD_DB to the width the CNN was trained on, and sent to the MicroBatcher. With both inputs the
+    probabilities are combined by the fitted EnsembleScorer (models named 'cnn' and 'tabular') if
+    there is one, else averaged. The ensemble must combine every loaded model and no other.
+
+    Parameters:
+        model (nn.Module): ImprovedCNN in eval mode, or None to serve the tabular model only.
+        spectrogram_shape (tuple): (n_mels, frames) expected by the CNN.
+        engineer (FeatureEngineer): Fitted feature engineer of the tabular model, or None.
+        tabular_model: Classifier with predict_proba trained on the engineer's features, or None.
+        ensemble (EnsembleScorer): Fitted scorer combining 'cnn' and 'tabular', or None.
+        max_batch (int): Largest CNN batch.
+        max_wait_ms (float): Longest wait to fill a CNN batch.
+        device (str): Torch device of the CNN.
+    """
+
+    def __init__(self, model, spectrogram_shape, engineer=None, tabular_model=None, ensemble=None,
+                 max_batch=max_batch, max_wait_ms=max_wait_ms, device='cpu'):
+        if ensemble is not None:
+            served = {name for name, loaded in [('cnn', model), ('tabular', tabular_model)] if loaded is not None}
+            if not set(ensemble.names) <= {'cnn', 'tabular'} or not served <= set(ensemble.names):
+                raise ValueError(f"The ensemble combines {ensemble.names}: it must combine 'cnn' and/or 'tabular', "
+                                 f"including every loaded model ({sorted(served)})")
+        self.spectrogram_shape = tuple(spectrogram_shape) if spectrogram_shape is not None else None
+        self.engineer = engineer
+        self.tabular_model = tabular_model
+        self.ensemble = ensemble
+        self.batcher = MicroBatcher(model, max_batch, max_wait_ms, device) if model is not None else None
+        self.session = requests.Session()
+        self.latency = LatencyStats()
+
+    def spectrogram(self, request):
+        """Returns the (n_mels, frames) float32 spectrogram of a request, or None if it has no audio."""
+        n_mels, width = self.spectrogram_shape
+        if 'spectrogram' in request:
+            # Precomputed dB spectrogram: base64 float32 bytes, row-major (n_mels, frames)
+            spectrogram = np.frombuffer(base64.b64decode(request['spectrogram']), dtype=np.float32)
+            spectrogram = spectrogram.reshape(n_mels, -1)
+        elif 'audio' in request or 'preview_url' in request:
+            if 'audio' in request:
+                data = base64.b64decode(request['audio'])
+            else:
+                data = fetch_preview(self.session, request['preview_url'])
+            spectrogram = get_spectrogram(io.BytesIO(data), n_mels=n_mels)
+        else:
+            return None
+        # Same frames as the training clips: cut longer clips, pad shorter ones like the 'pad' length policy
+        out = np.full((n_mels, width), PAD_DB, dtype=np.float32)
+        frames = min(width, spectrogram.shape[1])
+        out[:, :frames] = spectrogram[:, :frames]
+        return out
+
+    def tabular_probability(self, features):
+        X = pd.DataFrame([features])
+        missing = [column for column in self.engineer.columns if column not in X]
+        if missing:
+            raise ValueError(f"Missing audio features: {missing}")
+        X = X[self.engineer.columns].astype({column: np.float64 for column in self.engineer.num_cols})
+        return float(self.tabular_model.predict_proba(self.engineer.transform(X))[0, 1])
+
+    def predict(self, request):
+        """
+        Scores one request: {'song_id' (optional), 'features' ({column: value}) and/or 'audio'
+        (base64 MP3) or 'preview_url' or 'spectrogram'}. Returns the probability of each model and
+        the combined 'probability'.
+        """
+        start = time.perf_counter()
+        probabilities = {}
+        if request.get('features') is not None:
+            if self.tabular_model is None:
+                raise ValueError("No tabular model is loaded.")
+            probabilities['tabular'] = self.tabular_probability(request['features'])
+        if any(key in request for key in ('audio', 'preview_url', 'spectrogram')):
+            if self.batcher is None:
+                raise ValueError("No CNN is loaded.")
+            probabilities['cnn'] = self.batcher.predict(self.spectrogram(request))
+        if not probabilities:
+            raise ValueError("The request has no 'features', 'audio', 'preview_url' or 'spectrogram'.")
+
+        if self.ensemble is not None:
+            probability = float(self.ensemble.combine({name: [p] for name, p in probabilities.items()})[0])
+        else:
+            probability = float(np.mean(list(probabilities.values())))
+        self.latency.add(time.perf_counter() - start)
+        return {'song_id': request.get('song_id'), 'cnn': probabilities.get('cnn'),
+                'tabular': probabilities.get('tabular'), 'probability': probability,
+                'prediction': int(probability >= 0.5)}
+
+    def stats(self):
+        stats = {'requests': self.latency.summary()}
+        if self.batcher is not None:
+            batch_sizes = list(self.batcher.batch_sizes)
+            stats['cnn'] = dict(self.batcher.latency.summary(), max_batch=self.batcher.max_batch,
+                                max_wait_ms=self.batcher.max_wait * 1000,
+                                mean_batch_size=round(float(np.mean(batch_sizes)), 2) if batch_sizes else None)
+        return stats
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+
+
+class TasteHandler(BaseHTTPRequestHandler):
+    """POST /predict scores a JSON request, GET /stats returns the latency percentiles, GET /health returns ok."""
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.server.service.stats())
+        elif self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._reply(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            self._reply(200, self.server.service.predict(request))
+        except (ValueError, KeyError, requests.RequestException) as e:
+            self._reply(400, {'error': f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+# Function to start the HTTP server of a TasteService (serve_forever blocks; call server.shutdown() to stop)
+def make_server(service, host='127.0.0.1', port=8000, verbose=False):
+    server = ThreadingHTTPServer((host, port), TasteHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+# Function to load the models and build the service
+def load_service(cnn_path=model_path, tabular_path=tabular_model_path, ensemble_file=ensemble_path,
+                 reference_path=reference_data_path, max_batch=max_batch, max_wait_ms=max_wait_ms, device='cpu'):
+    model, spectrogram_shape = None, None
+    if cnn_path:
+        _, _, height, width = open_dataset(reference_path).shape
+        spectrogram_shape = (height, width)
+        model = load_model(cnn_path, height, width, conv_channels=conv_channels, fc_units=fc_units,
+                           dropout_rate=dropout_rate, device=device)
+    engineer, tabular_model = load_tabular_model(tabular_path) if tabular_path else (None, None)
+    ensemble = None
+    if ensemble_file:
+        with open(ensemble_file, 'rb') as f:
+            ensemble = pickle.load(f)
+    return TasteService(model, spectrogram_shape, engineer, tabular_model, ensemble,
+                        max_batch=max_batch, max_wait_ms=max_wait_ms, device=device)
+
+# Function to send concurrent requests to a running service and return the client-side latency percentiles
+def load_test(url, payloads, n_requests=200, concurrency=16):
+    def send(payload):
+        start = time.perf_counter()
+        request = urllib.request.Request(f'{url}/predict', data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(send, [payloads[i % len(payloads)] for i in range(n_requests)]))
+    elapsed = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {'requests_per_s': round(n_requests / elapsed, 1), 'p50_ms': round(float(p50), 3),
+            'p99_ms': round(float(p99), 3)}
+
+# Function to build load-test requests from the spectrograms of an HDF5 split
+def spectrogram_payloads(data_path, n=64):
+    dataset = open_dataset(data_path)
+    payloads = []
+    for i in range(min(n, len(dataset))):
+        spectrogram, _ = dataset[i]
+        payloads.append({'song_id': str(dataset.song_ids[i]),
+                         'spectrogram': base64.b64encode(spectrogram[0].numpy().astype(np.float32).tobytes()).decode()})
+    return payloads
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve like/dislike predictions of the CNN and the tabular model over HTTP.")
+    parser.add_argument('--cnn', default=model_path, help="Saved ImprovedCNN state dict ('' to serve without it).")
+    parser.add_argument('--tabular', default=tabular_model_path, help="model_zoo.py --save pickle ('' to serve without it).")
+    parser.add_argument('--ensemble', default=ensemble_path, help="ensemble.py --save pickle (defaults to averaging).")
+    parser.add_argument('--reference', default=reference_data_path, help="Spectrogram split giving the CNN input size.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=max_batch)
+    parser.add_argument('--max-wait-ms', type=float, default=max_wait_ms)
+    parser.add_argument('--threads', type=int, default=None, help="Number of intra-op CPU threads.")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--load-test', type=int, default=None, metavar='N',
+                        help="Send N requests built from the reference split, print the latencies and exit.")
+    parser.add_argument('--concurrency', type=int, default=16, help="Clients of the load test.")
+    parser.add_argument('--verbose', action='store_true', help="Log every request.")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    service = load_service(args.cnn, args.tabular, args.ensemble, args.reference, max_batch=args.max_batch,
+                           max_wait_ms=args.max_wait_ms, device=args.device)
+    server = make_server(service, args.host, args.port, verbose=args.verbose)
+    url = f'http://{args.host}:{server.server_address[1]}'
+
+    if args.load_test is None:
+        print(f"Serving on {url} (max batch {args.max_batch}, max wait {args.max_wait_ms} ms)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = load_test(url, spectrogram_payloads(args.reference), n_requests=args.load_test,
+                           concurrency=args.concurrency)
+        print(f"Client: {client}")
+        print(f"Server: {service.stats()}")
+        server.shutdown()
+    server.server_close()
+    service.close()
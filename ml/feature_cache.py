@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+from feature_engineering import FeatureEngineer, NON_FEATURE_COLUMNS, train_data_path, test_data_path
+
+# Directory of the cached feature matrices (one subdirectory per key)
+feature_cache_dir = '/Users/elcachorrohumano/workspace/MusicNN/data/feature_cache'
+validation_data_path = '/Users/elcachorrohumano/workspace/MusicNN/data/validation/validation.csv'
+
+# Source of the feature code: any change to it invalidates the cached matrices
+FEATURE_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feature_engineering.py')
+
+ENGINEER_FILE = 'engineer.pkl'
+META_FILE = 'meta.json'
+
+
+# Function to hash the content of tables: column names, dtypes and values, in order (the index is ignored)
+def table_digest(*tables):
+    digest = hashlib.sha256()
+    for table in tables:
+        if isinstance(table, pd.Series):
+            table = table.to_frame()
+        digest.update(json.dumps([[str(col) for col in table.columns], [str(dtype) for dtype in table.dtypes]]).encode())
+        digest.update(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+# Function to get the settings of a FeatureEngineer that change its output
+def engineer_config(engineer):
+    return {'k': engineer.selector.k, 'drop_duplicates': engineer.drop_duplicates, 'eps': engineer.eps}
+
+
+class FeatureCache:
+    """
+    Disk cache of engineered feature matrices, so experiments on the same data skip FeatureEngineer.
+
+    An entry is keyed by the content of the tables (the features and labels the engineer is fitted
+    on, and every table it transforms), the engineer's settings and the source of
+    feature_engineering.py. It holds the fitted engineer (scaler, selector and column layout)
+    pickled, and one float32 .npy matrix per split, loaded memory-mapped: a hit costs the hash of
+    the input tables and opening the files, not the feature computation.
+
+    Entries are written to a temporary directory and renamed into place, so processes sharing the
+    cache never read a partial entry.
+
+    Parameters:
+        cache_dir (str): Directory of the cache (created if missing).
+    """
+
+    def __init__(self, cache_dir=feature_cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(FEATURE_SOURCE, 'rb') as f:
+            self.source_digest = hashlib.sha256(f.read()).hexdigest()
+
+    def key(self, X_fit, y_fit, splits, config):
+        """Returns the key of the features of `splits` ({name: table}) with an engineer fitted on X_fit, y_fit."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'config': config, 'source': self.source_digest}, sort_keys=True).encode())
+        digest.update(table_digest(X_fit, y_fit).encode())
+        for name in sorted(splits):
+            digest.update(name.encode())
+            digest.update(table_digest(splits[name]).encode())
+        return digest.hexdigest()[:32]
+
+    def load(self, key):
+        """Returns (engineer, {split: DataFrame}) for `key`, or None if it is not cached."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            return None
+        with open(os.path.join(entry_dir, META_FILE), 'r') as f:
+            meta = json.load(f)
+        with open(os.path.join(entry_dir, ENGINEER_FILE), 'rb') as f:
+            engineer = pickle.load(f)
+        features = {}
+        for name, index in meta['splits'].items():
+            # Copy-on-write map: the frames are writable without ever touching the cached file
+            matrix = np.load(os.path.join(entry_dir, f'{name}.npy'), mmap_mode='c')
+            index = pd.RangeIndex(len(matrix)) if index is None else pd.Index(index)
+            features[name] = pd.DataFrame(matrix, columns=engineer.feature_names, index=index, copy=False)
+        return engineer, features
+
+    def save(self, key, engineer, features):
+        """Stores a fitted engineer and its feature frames ({split: DataFrame}) under `key`."""
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=f'.{key}-')
+        try:
+            for name, frame in features.items():
+                np.save(os.path.join(tmp_dir, f'{name}.npy'), frame.to_numpy(dtype=np.float32))
+            with open(os.path.join(tmp_dir, ENGINEER_FILE), 'wb') as f:
+                pickle.dump(engineer, f)
+            with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+                # Row labels, unless they are the default 0..n-1
+                splits = {name: None if frame.index.equals(pd.RangeIndex(len(frame))) else frame.index.tolist()
+                          for name, frame in features.items()}
+                json.dump({'splits': splits, 'config': engineer_config(engineer), 'created_at': time.time()}, f)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                raise
+
+    def fit_transform(self, engineer, X_fit, y_fit, splits):
+        """
+        Returns (engineer, {split: DataFrame}): the features of 'train' (X_fit, y_fit) and of each
+        table of `splits` ({name: table}), from the cache or computed with `engineer` and cached.
+        On a hit the returned engineer is the cached, fitted one.
+        """
+        key = self.key(X_fit, y_fit, splits, engineer_config(engineer))
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+        features = {'train': engineer.fit_transform(X_fit, y_fit)}
+        for name, X in splits.items():
+            features[name] = engineer.transform(X)
+        self.save(key, engineer, features)
+        return engineer, features
+
+
+# Function to get the engineered features of the train table and the other splits, cached on disk
+def cached_features(X_train, y_train, splits, engineer=None, cache=None):
+    cache = cache or FeatureCache()
+    return cache.fit_transform(engineer or FeatureEngineer(), X_train, y_train, splits)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build (or load) the cached feature matrices of the tabular splits.")
+    parser.add_argument('--train', default=train_data_path)
+    parser.add_argument('--val', default=validation_data_path)
+    parser.add_argument('--test', default=test_data_path)
+    parser.add_argument('--cache-dir', default=feature_cache_dir)
+    args = parser.parse_args()
+
+    tables = {name: pd.read_csv(path) for name, path in [('train', args.train), ('val', args.val), ('test', args.test)]}
+    X = {name: table.drop(columns=NON_FEATURE_COLUMNS) for name, table in tables.items()}
+    cache = FeatureCache(args.cache_dir)
+    for attempt in ['first call', 'second call']:
+        start = time.perf_counter()
+        _, features = cached_features(X['train'], tables['train']['like'], {'val': X['val'], 'test': X['test']},
+                                      cache=cache)
+        shapes = ', '.join(f"{name} {frame.shape}" for name, frame in features.items())
+        print(f"{attempt}: {(time.perf_counter() - start) * 1000:.1f} ms ({shapes})")
@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import pickle
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold, ParameterGrid
+from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
+from catboost import CatBoostClassifier
+from xgboost import XGBClassifier
+from lightgbm import LGBMClassifier, early_stopping
+
+from feature_engineering import NON_FEATURE_COLUMNS, train_data_path, test_data_path
+from feature_cache import cached_features, validation_data_path
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ensemble'))
+from ensemble import save_predictions, models as prediction_tables
+
+# Parameters of run_ml_pipeline in catboost.ipynb
+catboost_params = {
+    'iterations': 1000,
+    'learning_rate': 0.1,
+    'depth': 6,
+    'l2_leaf_reg': 3,
+    'eval_metric': 'AUC',
+    'verbose': False,
+    # The jobs run at the same time in one process: writing logs to the shared catboost_info/ would mix them
+    'allow_writing_files': False
+}
+xgb_param_grid = {
+    'max_depth': [3],
+    'learning_rate': [0.01],
+    'n_estimators': [100],
+    'subsample': [0.8]
+}
+lgbm_params = {
+    'n_estimators': 100,
+    'learning_rate': 0.1,
+    'num_leaves': 31,
+    'feature_fraction': 0.8,
+    'verbose': -1
+}
+
+# Constructor arguments that set the number of threads and the seed of each library
+THREAD_PARAMS = {CatBoostClassifier: 'thread_count', XGBClassifier: 'n_jobs', LGBMClassifier: 'n_jobs'}
+SEED_PARAMS = {CatBoostClassifier: 'random_seed', XGBClassifier: 'random_state', LGBMClassifier: 'random_state'}
+
+# Threads of every model fit unless set otherwise: boosting results can change with the thread count of a fit
+# (summation order), so it does not depend on the number of cores
+threads_per_job = 1
+
+
+# Function to get the number of cores this process may run on
+def available_cores():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+
+class CoreBudget:
+    """
+    Counting semaphore over a fixed number of cores: a job running on n threads holds n cores, and
+    waits until they are free, so the jobs running at once never use more threads than the budget.
+
+    Parameters:
+        cores (int): Number of cores shared by the jobs.
+    """
+
+    def __init__(self, cores):
+        self.cores = cores
+        self.free = cores
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def take(self, n):
+        n = min(n, self.cores)
+        with self.condition:
+            self.condition.wait_for(lambda: self.free >= n)
+            self.free -= n
+        try:
+            yield n
+        finally:
+            with self.condition:
+                self.free += n
+                self.condition.notify_all()
+
+
+# Function to copy a model with an explicit thread count and seed
+def configure_model(model, threads, seed):
+    model = clone(model)
+    model.set_params(**{THREAD_PARAMS[type(model)]: threads, SEED_PARAMS[type(model)]: seed})
+    return model
+
+# Function to run independent jobs on a core budget
+def run_jobs(jobs, budget, threads_per_job):
+    """
+    Runs `jobs` ({name: fn}, each called as fn(threads)) with `threads_per_job` threads each, as
+    many at a time as the budget allows, in the order given. The libraries train in native code
+    without holding the GIL, so the jobs run on threads of this process.
+
+    Returns ({name: result}, {name: seconds}).
+    """
+    seconds = {}
+
+    def run(name, fn):
+        with budget.take(threads_per_job) as threads:
+            start = time.perf_counter()
+            result = fn(threads)
+            seconds[name] = time.perf_counter() - start
+            return result
+
+    max_workers = max(1, budget.cores // min(threads_per_job, budget.cores))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(run, name, fn) for name, fn in jobs.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    return results, seconds
+
+
+# Function to save a fitted engineer and the model trained on its features, to be served together
+def save_tabular_model(path, engineer, model):
+    with open(path, 'wb') as f:
+        pickle.dump({'engineer': engineer, 'model': model}, f)
+
+# Function to load the (engineer, model) pair saved by save_tabular_model
+def load_tabular_model(path):
+    with open(path, 'rb') as f:
+        bundle = pickle.load(f)
+    return bundle['engineer'], bundle['model']
+
+
+# Function to write a fitted model's predictions on the validation and test tables, for ensemble.py
+def save_tabular_predictions(model, features, tables, csv_paths=prediction_tables['tabular']):
+    for split, csv_path in zip(['val', 'test'], csv_paths):
+        save_predictions(csv_path, tables[split]['id'].astype(str), model.predict_proba(features[split])[:, 1],
+                         tables[split]['like'])
+
+
+def evaluate_model(y_true, y_pred, y_prob):
+    return {
+        'accuracy': accuracy_score(y_true, y_pred),
+        'precision': precision_score(y_true, y_pred),
+        'recall': recall_score(y_true, y_pred),
+        'f1': f1_score(y_true, y_pred),
+        'roc_auc': roc_auc_score(y_true, y_prob)
+    }
+
+# Function to fit a model and get its metrics on held-out data
+def fit_evaluate(model, X_fit, y_fit, X_eval, y_eval):
+    model.fit(X_fit, y_fit)
+    return model, evaluate_model(y_eval, model.predict(X_eval), model.predict_proba(X_eval)[:, 1])
+
+
+# Main function: run_ml_pipeline of catboost.ipynb with every model and CV fold scheduled on a core budget
+def run_model_zoo(X_train, X_test, y_train, y_test, core_budget=None, threads_per_job=threads_per_job, cv=5, seed=0,
+                  verbose=True):
+    """
+    Trains the same models as run_ml_pipeline (CatBoost with 5-fold cross-validation, XGBoost
+    tuned with a 5-fold grid search on ROC AUC, LightGBM tuned with early stopping) and returns
+    (best model, metrics DataFrame, CatBoost CV scores, seconds per job).
+
+    The work is split into independent jobs (every CV fold, every grid point and fold, every
+    final fit) that share `core_budget` cores, each with `threads_per_job` threads set explicitly
+    through thread_count / n_jobs. The jobs that depend on a tuning result (the final XGBoost and
+    LightGBM fits) run in a second wave. Folds are the ones cross_validate and GridSearchCV use
+    (StratifiedKFold without shuffling) and every model gets the seed `seed`, so results only
+    depend on the data, the seed and `threads_per_job` (fixed, 1 by default), not on the core budget
+    or how the jobs are scheduled: the budget only sets how many jobs run at once.
+    """
+    core_budget = core_budget or available_cores()
+    folds = list(StratifiedKFold(n_splits=cv).split(X_train, y_train))
+    catboost = CatBoostClassifier(**catboost_params)
+    xgb = XGBClassifier(eval_metric='logloss')
+    xgb_grid = list(ParameterGrid(xgb_param_grid))
+
+    # CV folds and tuning first: the longest jobs (CatBoost, 1000 iterations) are queued first
+    first_wave = {}
+    for k, (fit_rows, eval_rows) in enumerate(folds):
+        def catboost_fold(threads, fit_rows=fit_rows, eval_rows=eval_rows):
+            _, metrics = fit_evaluate(configure_model(catboost, threads, seed), X_train.iloc[fit_rows],
+                                      y_train.iloc[fit_rows], X_train.iloc[eval_rows], y_train.iloc[eval_rows])
+            return metrics
+        first_wave[f'catboost/fold_{k}'] = catboost_fold
+    first_wave['catboost/final'] = lambda threads: fit_evaluate(configure_model(catboost, threads, seed),
+                                                                X_train, y_train, X_test, y_test)
+    for p, params in enumerate(xgb_grid):
+        for k, (fit_rows, eval_rows) in enumerate(folds):
+            def xgb_fold(threads, params=params, fit_rows=fit_rows, eval_rows=eval_rows):
+                model = configure_model(xgb, threads, seed).set_params(**params)
+                model.fit(X_train.iloc[fit_rows], y_train.iloc[fit_rows])
+                return roc_auc_score(y_train.iloc[eval_rows], model.predict_proba(X_train.iloc[eval_rows])[:, 1])
+            first_wave[f'xgb/{p}/fold_{k}'] = xgb_fold
+
+    def lgbm_tune(threads):
+        model = configure_model(LGBMClassifier(**lgbm_params), threads, seed)
+        model.fit(X_train, y_train, eval_set=[(X_test, y_test)], eval_metric='auc',
+                  callbacks=[early_stopping(10, verbose=False)])
+        return model.best_iteration_
+    first_wave['lgbm/tune'] = lgbm_tune
+
+    budget = CoreBudget(core_budget)
+    if verbose:
+        print(f"{len(first_wave)} jobs on {core_budget} cores, {threads_per_job} threads each")
+    start = time.perf_counter()
+    results, seconds = run_jobs(first_wave, budget, threads_per_job)
+
+    cv_scores = {f'test_{metric}': np.array([results[f'catboost/fold_{k}'][metric] for k in range(cv)])
+                 for metric in ['accuracy', 'precision', 'recall', 'f1']}
+    xgb_scores = [np.mean([results[f'xgb/{p}/fold_{k}'] for k in range(cv)]) for p in range(len(xgb_grid))]
+    xgb_best_params = xgb_grid[int(np.argmax(xgb_scores))]
+    best_iteration = results['lgbm/tune']
+    lgbm_final = LGBMClassifier(
+        n_estimators=best_iteration,
+        learning_rate=0.05,
+        num_leaves=min(31, int(best_iteration/5)),
+        feature_fraction=0.7,
+        bagging_fraction=0.8,
+        bagging_freq=5,
+        verbose=-1
+    )
+
+    second_wave = {
+        'xgb/final': lambda threads: fit_evaluate(configure_model(xgb, threads, seed).set_params(**xgb_best_params),
+                                                  X_train, y_train, X_test, y_test),
+        'lgbm/final': lambda threads: fit_evaluate(configure_model(lgbm_final, threads, seed),
+                                                   X_train, y_train, X_test, y_test),
+    }
+    final_results, final_seconds = run_jobs(second_wave, budget, threads_per_job)
+    results.update(final_results)
+    seconds.update(final_seconds)
+
+    models = {'CatBoost': results['catboost/final'], 'XGBoost': results['xgb/final'],
+              'LightGBM': results['lgbm/final']}
+    metrics_df = pd.DataFrame({name: metrics for name, (_, metrics) in models.items()}).round(4)
+    best_model_name = metrics_df.loc['roc_auc'].idxmax()
+
+    if verbose:
+        print("\nCatBoost Cross-Validation Results:")
+        for metric, scores in cv_scores.items():
+            print(f"{metric}: {scores.mean():.4f} (+/- {scores.std() * 2:.4f})")
+        print("\nXGBoost Best Parameters:", xgb_best_params)
+        print("\nModel Comparison:")
+        print(metrics_df)
+        print(f"\nBest performing model: {best_model_name}")
+        print(f"Wall time {time.perf_counter() - start:.1f}s for {sum(seconds.values()):.1f}s of jobs")
+    return models[best_model_name][0], metrics_df, cv_scores, seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the CatBoost/XGBoost/LightGBM models on a core budget.")
+    parser.add_argument('--train', default=train_data_path)
+    parser.add_argument('--val', default=validation_data_path)
+    parser.add_argument('--test', default=test_data_path)
+    parser.add_argument('--cores', type=int, default=None, help="Core budget (defaults to every available core).")
+    parser.add_argument('--threads-per-job', type=int, default=threads_per_job,
+                        help="Threads of each model fit (the models depend on it, not on the core budget).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', default=None, metavar='PICKLE',
+                        help="Save the best model with its fitted feature engineer (e.g. for taste_service.py).")
+    parser.add_argument('--save-predictions', nargs=2, default=None, metavar=('VAL_CSV', 'TEST_CSV'),
+                        help="Write the best model's validation and test predictions for ensemble.py "
+                             f"(which reads {' and '.join(prediction_tables['tabular'])}).")
+    args = parser.parse_args()
+
+    tables = {split: pd.read_csv(path)
+              for split, path in [('train', args.train), ('val', args.val), ('test', args.test)]}
+    X_train, y_train = tables['train'].drop(columns=NON_FEATURE_COLUMNS), tables['train']['like']
+    X_test, y_test = tables['test'].drop(columns=NON_FEATURE_COLUMNS), tables['test']['like']
+    splits = {'test': X_test}
+    if args.save_predictions:
+        splits['val'] = tables['val'].drop(columns=NON_FEATURE_COLUMNS)
+    engineer, features = cached_features(X_train, y_train, splits)
+    best_model, _, _, _ = run_model_zoo(features['train'], features['test'], y_train, y_test, core_budget=args.cores,
+                                        threads_per_job=args.threads_per_job, seed=args.seed)
+    if args.save:
+        save_tabular_model(args.save, engineer, best_model)
+        print(f"Best model saved to {args.save}")
+    if args.save_predictions:
+        save_tabular_predictions(best_model, features, tables, args.save_predictions)
+        print(f"Predictions saved to {' and '.join(args.save_predictions)}")
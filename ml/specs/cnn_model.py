@@ -0,0 +1,63 @@
+import torch
+import torch.nn as nn
+
+
+class ImprovedCNN(nn.Module):
+    def __init__(self, input_height, input_width, num_classes, conv_channels=[32, 64, 128], fc_units=[512, 256], dropout_rate=0.25):
+        super(ImprovedCNN, self).__init__()
+        self.conv_layers = nn.ModuleList()
+        in_channels = 1
+
+        for out_channels in conv_channels:
+            self.conv_layers.append(nn.Sequential(
+                nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1),
+                nn.BatchNorm2d(out_channels),
+                nn.ReLU(),
+                nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1),
+                nn.BatchNorm2d(out_channels),
+                nn.ReLU(),
+                nn.MaxPool2d(2, 2),
+                nn.Dropout2d(dropout_rate)
+            ))
+            in_channels = out_channels
+
+        self.height_after_conv = input_height // (2 ** len(conv_channels))
+        self.width_after_conv = input_width // (2 ** len(conv_channels))
+
+        fc_layers = []
+        in_features = conv_channels[-1] * self.height_after_conv * self.width_after_conv
+
+        for units in fc_units:
+            fc_layers.extend([
+                nn.Linear(in_features, units),
+                nn.ReLU(),
+                nn.Dropout(dropout_rate),
+            ])
+            in_features = units
+
+        fc_layers.append(nn.Linear(in_features, num_classes))
+        self.fc = nn.Sequential(*fc_layers)
+
+    def forward(self, x):
+        for conv_layer in self.conv_layers:
+            x = conv_layer(x)
+        # flatten instead of view, so channels_last activations work as well
+        x = torch.flatten(x, 1)
+        return self.fc(x)
+
+
+# Function to rebuild an ImprovedCNN from a saved state dict, ready for inference
+def load_model(model_path, height, width, conv_channels=[32, 64, 128], fc_units=[512, 256], dropout_rate=0.25,
+               device='cpu'):
+    state_dict = torch.load(model_path, weights_only=True, map_location=device)
+    # The number of classes is the output size of the last linear layer
+    last_weight = [key for key in state_dict if key.startswith('fc.') and key.endswith('.weight')][-1]
+    num_classes = state_dict[last_weight].shape[0]
+
+    model = ImprovedCNN(height, width, num_classes,
+                        conv_channels=conv_channels,
+                        fc_units=fc_units,
+                        dropout_rate=dropout_rate).to(device)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
@@ -0,0 +1,126 @@
+import os
+import sys
+import copy
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from spec_dataset import H5SpectrogramDataset
+from cnn_model import load_model
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ensemble'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'transform'))
+from score_cnn import predict
+from track_index import TrackIndex
+
+# File paths
+model_path = '/Users/elcachorrohumano/workspace/MusicNN/ml/specs/fine_tuning/models/model_9.pth'
+val_data_path = '/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5'
+reference_csv_path = '/Users/elcachorrohumano/workspace/MusicNN/ml/ensemble/predictions_model_cnn_val.csv'
+output_dir = '/Users/elcachorrohumano/workspace/MusicNN/ml/specs/fine_tuning/models/exported'
+
+# Parameters of the saved model (model_9 of the grid search)
+conv_channels = [32, 64, 128]
+fc_units = [1024, 512]
+dropout_rate = 0.25
+
+# Function to fold every BatchNorm into the convolution before it (inference only)
+def fold_batchnorm(model):
+    model = copy.deepcopy(model).eval()
+    for conv_layer in model.conv_layers:
+        for i in range(len(conv_layer) - 1):
+            if isinstance(conv_layer[i], nn.Conv2d) and isinstance(conv_layer[i + 1], nn.BatchNorm2d):
+                conv_layer[i] = fuse_conv_bn_eval(conv_layer[i], conv_layer[i + 1])
+                conv_layer[i + 1] = nn.Identity()
+    return model
+
+# Function to quantize the linear layers to int8 (weights ahead of time, activations at runtime)
+def quantize_linear(model):
+    if 'fbgemm' not in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = 'qnnpack'  # ARM CPUs (e.g. Apple silicon)
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+
+# Function to trace, freeze and save a model as TorchScript
+def export_torchscript(model, example_inputs, path):
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example_inputs)
+    frozen = torch.jit.freeze(traced)
+    torch.jit.save(frozen, path)
+    return frozen
+
+# Function to measure single-clip latency and batched throughput of a model on CPU
+def benchmark(model, sample_shape, batch_size=64, n_iterations=20, n_warmup=3):
+    """Returns (median latency in ms for one clip, clips per second at `batch_size`)."""
+    single = torch.randn(1, *sample_shape)
+    batch = torch.randn(batch_size, *sample_shape)
+    with torch.inference_mode():
+        for _ in range(n_warmup):
+            model(single)
+            model(batch)
+
+        latencies = []
+        for _ in range(n_iterations):
+            start = time.perf_counter()
+            model(single)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(n_iterations):
+            model(batch)
+        elapsed = time.perf_counter() - start
+    return 1000 * float(np.median(latencies)), n_iterations * batch_size / elapsed
+
+# Function to compare a model's predictions on a split against the fp32 predictions CSV
+def parity(model, dataset, reference, batch_size=64):
+    """Returns the max absolute probability difference, the prediction agreement and the accuracy."""
+    predictions, probabilities = predict(model, dataset, 'cpu', batch_size=batch_size)
+    positions = reference.positions(dataset.song_ids)
+    if (positions < 0).any():
+        raise ValueError(f"{(positions < 0).sum()} song IDs of the split are missing from the reference CSV")
+    reference_probabilities = reference.df['probability'].to_numpy()[positions]
+    reference_predictions = reference.df['prediction'].to_numpy()[positions]
+    return {
+        'max_abs_diff': float(np.abs(probabilities - reference_probabilities).max()),
+        'agreement': float((predictions == reference_predictions).mean()),
+        'accuracy': float((predictions == dataset.labels.numpy()).mean()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export BatchNorm-folded and int8 versions of ImprovedCNN and compare them.")
+    parser.add_argument('--model', default=model_path)
+    parser.add_argument('--data', default=val_data_path, help="HDF5 split used for the parity check.")
+    parser.add_argument('--reference', default=reference_csv_path, help="fp32 predictions CSV of the same split.")
+    parser.add_argument('--output-dir', default=output_dir)
+    parser.add_argument('--threads', type=int, default=None, help="Number of intra-op CPU threads.")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    dataset = H5SpectrogramDataset(args.data)
+    sample_shape = dataset.shape[1:]
+    model = load_model(args.model, sample_shape[1], sample_shape[2],
+                       conv_channels=conv_channels, fc_units=fc_units, dropout_rate=dropout_rate)
+    example_inputs = torch.randn(1, *sample_shape)
+
+    variants = {
+        'fp32': model,
+        'fp32_folded': export_torchscript(fold_batchnorm(model), example_inputs,
+                                          os.path.join(args.output_dir, 'model_fp32_folded.pt')),
+        'int8_dynamic': export_torchscript(quantize_linear(fold_batchnorm(model)), example_inputs,
+                                           os.path.join(args.output_dir, 'model_int8_dynamic.pt')),
+    }
+    print(f"TorchScript models saved to {args.output_dir}")
+
+    reference = TrackIndex.from_csv(args.reference, id_column='song_id')
+    print(f"{'variant':<14}{'latency (ms)':>14}{'clips/s':>10}{'max |dp|':>11}{'agreement':>11}{'accuracy':>10}")
+    for name, variant in variants.items():
+        latency, throughput = benchmark(variant, sample_shape)
+        check = parity(variant, dataset, reference)
+        print(f"{name:<14}{latency:>14.2f}{throughput:>10.1f}{check['max_abs_diff']:>11.2e}"
+              f"{check['agreement']:>11.4f}{check['accuracy']:>10.4f}")
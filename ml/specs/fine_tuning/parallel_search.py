@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from results_store import ResultsStore, params_key, results_db_file
+
+# File paths
+train_data_path = '/Users/elcachorrohumano/workspace/MusicNN/data/train/spec_train.h5'
+val_data_path = '/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5'
+save_path = '/Users/elcachorrohumano/workspace/MusicNN/ml/specs/fine_tuning'
+
+# Same grid as pytorch_cnn_gs.ipynb, in the same order, so model_<i> / results_<i> keep their meaning
+param_grid = {
+    'conv_channels': [[32, 64, 128], [64, 128, 256]],
+    'fc_units': [[512, 256], [1024, 512]],
+    'dropout_rate': [0.25, 0.5],
+    'learning_rate': [0.001, 0.0005],
+    'weight_decay': [0.01, 0.001]
+}
+
+
+# Function to list every combination of the grid
+def get_param_combinations(param_grid=param_grid):
+    return [dict(zip(param_grid.keys(), v)) for v in product(*param_grid.values())]
+
+# Function to get the epochs at which trials are compared (min_epochs, min_epochs * eta, ... below max_epochs)
+def rung_epochs(min_epochs, eta, max_epochs):
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    return rungs
+
+
+class AshaPruner:
+    """
+    Asynchronous successive halving (ASHA) shared by the trial processes.
+
+    When a trial reaches a rung epoch, its best validation accuracy so far is recorded for that rung
+    and it keeps training only if it ranks in the top 1/eta of every trial recorded at that rung so far
+    (the first trials of a rung continue while they are the best one). Trials never wait for each
+    other, so slow configurations don't hold up the workers.
+
+    Parameters:
+        rungs (list): Epochs at which trials are compared.
+        eta (int): Reduction factor: about 1/eta of the trials survive each rung.
+        manager (multiprocessing.Manager): Holds the rung records shared between processes.
+        records (dict): Values already recorded at each rung (e.g. by the trials of a resumed search).
+    """
+
+    def __init__(self, rungs, eta, manager, records=None):
+        self.rungs = set(rungs)
+        self.eta = eta
+        records = records or {}
+        self.records = manager.dict({rung: list(records.get(rung, [])) for rung in rungs})
+        self.lock = manager.Lock()
+
+    def should_stop(self, epochs_done, metrics):
+        if epochs_done not in self.rungs:
+            return False
+        value = max(metrics['val_acc'])
+        with self.lock:
+            recorded = self.records[epochs_done] + [value]
+            self.records[epochs_done] = recorded  # Manager dicts only see reassigned values
+        n_promoted = max(1, len(recorded) // self.eta)
+        return value < sorted(recorded, reverse=True)[n_promoted - 1]
+
+
+# Function run once in each worker process: pins it to its own cores and sets its thread count
+def _init_worker(core_slots, threads_per_trial):
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_trial)
+    cores = core_slots.get()
+    if cores and hasattr(os, 'sched_setaffinity'):  # Linux only; elsewhere only the thread count is set
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(threads_per_trial)
+
+# Function run in the worker processes: trains one configuration, saving its model and recording it in the store
+def run_trial(i, params, train_path, val_path, save_path, db_file, pruner, max_epochs=30, patience=5, batch_size=64,
+              engine_options=None):
+    import torch
+    from spec_dataset import open_dataset, make_loader
+    from train_engine import build_training, train_model
+
+    train_dataset, val_dataset = open_dataset(train_path), open_dataset(val_path)
+    train_loader = make_loader(train_dataset, batch_size=batch_size, shuffle=True)
+    val_loader = make_loader(val_dataset, batch_size=batch_size)
+    _, _, height, width = train_dataset.shape
+    num_classes = len(set(train_dataset.labels.numpy()))
+
+    torch.manual_seed(i)
+    model, criterion, optimizer, scheduler = build_training(params, height, width, num_classes)
+    model_path = f'{save_path}/models/model_{i}.pth'
+
+    store = ResultsStore(db_file)
+    key = store.start_trial(params, model_path=model_path)
+    pruned = []
+    def epoch_callback(epochs_done, metrics):
+        store.log_epoch(key, epochs_done, {column: values[-1] for column, values in metrics.items()})
+        if pruner is not None and pruner.should_stop(epochs_done, metrics):
+            pruned.append(epochs_done)
+            return True
+        return False
+
+    start = time.perf_counter()
+    try:
+        train_model(model, train_loader, val_loader, criterion, optimizer, scheduler, 'cpu',
+                    max_epochs=max_epochs, patience=patience, model_path=model_path, verbose=False,
+                    epoch_callback=epoch_callback, **(engine_options or {}))
+    except Exception:
+        store.finish_trial(key, status='failed')
+        raise
+    store.finish_trial(key, status='pruned' if pruned else 'completed', pruned_at=pruned[0] if pruned else None)
+    result = store.get(params)
+    result['seconds'] = time.perf_counter() - start
+    store.close()
+    return i, result
+
+# Main function to run the grid search on parallel processes with ASHA pruning
+def parallel_search(train_path, val_path, save_path, params_list=None, db_file=results_db_file, n_parallel=None,
+                    threads_per_trial=1, max_epochs=30, patience=5, min_epochs=3, eta=3, prune=True, batch_size=64,
+                    engine_options=None):
+    """
+    Trains the grid configurations `n_parallel` at a time, each in its own process with
+    `threads_per_trial` torch threads pinned to its own cores, and returns the best result.
+
+    With `prune`, trials are compared at epochs min_epochs, min_epochs * eta, ... (see AshaPruner)
+    and the weaker ones stop there. Patience-based early stopping still applies. Each trial saves
+    models/model_<i>.pth like the notebooks and records its epochs in the results store (`db_file`,
+    see results_store.py) as 'completed' or 'pruned'. Trials already finished in the store are
+    skipped, so an interrupted search resumes where it stopped.
+    """
+    params_list = params_list or get_param_combinations()
+    store = ResultsStore(db_file)
+    done = store.done_keys()
+    pending = [(i, params) for i, params in enumerate(params_list) if params_key(params) not in done]
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    n_parallel = n_parallel or max(1, len(cores) // threads_per_trial)
+    os.makedirs(f'{save_path}/models', exist_ok=True)
+
+    context = mp.get_context('spawn')
+    manager = context.Manager()
+    # One set of cores per worker process (none when there are fewer cores than workers need)
+    core_slots = manager.Queue()
+    for slot in range(n_parallel):
+        slot_cores = cores[slot * threads_per_trial:(slot + 1) * threads_per_trial]
+        core_slots.put(slot_cores if len(slot_cores) == threads_per_trial else None)
+
+    rungs = rung_epochs(min_epochs, eta, max_epochs) if prune else []
+    pruner = AshaPruner(rungs, eta, manager, {rung: store.rung_values(rung) for rung in rungs}) if prune else None
+    print(f"{len(pending)} trials to run ({len(params_list) - len(pending)} already done), {n_parallel} at a time "
+          f"with {threads_per_trial} threads each, pruning at epochs {rungs}")
+
+    results = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_parallel, mp_context=context, initializer=_init_worker,
+                             initargs=(core_slots, threads_per_trial)) as executor:
+        futures = [executor.submit(run_trial, i, params, train_path, val_path, save_path, db_file, pruner,
+                                   max_epochs=max_epochs, patience=patience, batch_size=batch_size,
+                                   engine_options=engine_options)
+                   for i, params in pending]
+        for future in as_completed(futures):
+            i, result = future.result()
+            results[i] = result
+            status = f"pruned at epoch {result['pruned_at']}" if result['pruned_at'] else f"{result['epochs']} epochs"
+            print(f"Model {i}: best val acc {result['best_val_acc']:.4f} ({status}, {result['seconds']:.0f}s)")
+    manager.shutdown()
+
+    total_epochs = sum(result['epochs'] for result in results.values())
+    print(f"\nSearch finished in {time.perf_counter() - start:.0f}s, {total_epochs} epochs trained "
+          f"(a full grid is {len(pending) * max_epochs} at most)")
+    # The best finished trial of the grid, including those of earlier runs
+    keys = {params_key(params) for params in params_list}
+    best_result = next(result for result in store.best('best_val_acc', n=len(store.done_keys()))
+                       if result['key'] in keys)
+    store.close()
+    print(f"Best model: {best_result['model_path']} {best_result['params']}")
+    print(f"Best validation accuracy: {best_result['best_val_acc']:.4f}")
+    return best_result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parallel ImprovedCNN grid search with ASHA pruning.")
+    parser.add_argument('--train', default=train_data_path)
+    parser.add_argument('--val', default=val_data_path)
+    parser.add_argument('--save-path', default=save_path)
+    parser.add_argument('--db', default=results_db_file, help="Results store (see results_store.py).")
+    parser.add_argument('--parallel', type=int, default=None, help="Concurrent trials (defaults to cores / threads).")
+    parser.add_argument('--threads', type=int, default=1, help="Torch threads (and pinned cores) per trial.")
+    parser.add_argument('--max-epochs', type=int, default=30)
+    parser.add_argument('--min-epochs', type=int, default=3, help="Epoch of the first pruning rung.")
+    parser.add_argument('--eta', type=int, default=3, help="Reduction factor between rungs.")
+    parser.add_argument('--no-prune', action='store_true', help="Train every trial to the end (early stopping only).")
+    parser.add_argument('--bf16', action='store_true', help="bfloat16 autocast (CPU).")
+    parser.add_argument('--channels-last', action='store_true')
+    args = parser.parse_args()
+
+    engine_options = {'channels_last': args.channels_last}
+    if args.bf16:
+        import torch
+        engine_options['autocast_dtype'] = torch.bfloat16
+    parallel_search(args.train, args.val, args.save_path, db_file=args.db, n_parallel=args.parallel,
+                    threads_per_trial=args.threads,
+                    max_epochs=args.max_epochs, min_epochs=args.min_epochs, eta=args.eta, prune=not args.no_prune,
+                    engine_options=engine_options)
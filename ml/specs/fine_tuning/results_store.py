@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# Database with the results of every grid search trial (replaces the results_<i>.json files)
+results_db_file = '/Users/elcachorrohumano/workspace/MusicNN/ml/specs/fine_tuning/results.sqlite'
+results_folder = '/Users/elcachorrohumano/workspace/MusicNN/ml/specs/fine_tuning/results'
+
+# Per-epoch metrics recorded by train_engine.train_model
+EPOCH_COLUMNS = ['train_loss', 'val_loss', 'train_acc', 'val_acc', 'epoch_time', 'train_samples_per_s']
+
+# Trial summaries that can be ranked, with the order that puts the best trial first
+RANKED_METRICS = {'best_val_acc': 'DESC', 'best_val_loss': 'ASC'}
+
+# Trials that are not trained again when a search is resumed ('running' and 'failed' ones are)
+DONE_STATUSES = ('completed', 'pruned')
+
+
+# Function to get the key of a trial: a hash of its hyperparameters, independent of their order
+def params_key(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class ResultsStore:
+    """
+    SQLite store of grid search trials, shared by the processes of a search.
+
+    A trial is keyed by the hash of its hyperparameters (params_key), so running the same grid again
+    finds the trials that already finished and skips them. Every epoch is written as it ends, and
+    each trial keeps its best validation accuracy and loss so far in indexed columns: ranking a sweep
+    is one indexed query instead of parsing every result file.
+
+    Results are returned as the dicts the notebooks wrote to results_<i>.json ('params',
+    'best_val_acc', 'best_val_loss', 'model_path', 'metrics'), plus 'key', 'status' and 'epochs'.
+
+    Parameters:
+        db_file (str): Path of the SQLite database (created if missing).
+        timeout (float): Seconds to wait for a write lock held by another process.
+    """
+
+    def __init__(self, db_file, timeout=60):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=timeout, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(
+            'CREATE TABLE IF NOT EXISTS trials ('
+            'key TEXT PRIMARY KEY, params TEXT NOT NULL, status TEXT NOT NULL, model_path TEXT, '
+            'best_val_acc REAL, best_val_loss REAL, epochs INTEGER NOT NULL DEFAULT 0, pruned_at INTEGER, '
+            'started_at REAL, finished_at REAL);'
+            'CREATE INDEX IF NOT EXISTS trials_by_acc ON trials (status, best_val_acc);'
+            'CREATE INDEX IF NOT EXISTS trials_by_loss ON trials (status, best_val_loss);'
+            'CREATE TABLE IF NOT EXISTS epochs ('
+            'key TEXT NOT NULL, epoch INTEGER NOT NULL, '
+            + ', '.join(f'{column} REAL' for column in EPOCH_COLUMNS) +
+            ', PRIMARY KEY (key, epoch));')
+        self.conn.commit()
+
+    def start_trial(self, params, model_path=None):
+        """Records a trial as running (dropping the epochs of a previous unfinished run) and returns its key."""
+        key = params_key(params)
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM epochs WHERE key = ?', (key,))
+            self.conn.execute('INSERT OR REPLACE INTO trials (key, params, status, model_path, started_at) '
+                              'VALUES (?, ?, ?, ?, ?)', (key, json.dumps(params), 'running', model_path, time.time()))
+        return key
+
+    def log_epoch(self, key, epoch, metrics):
+        """Records the metrics of one epoch (1-based) given as {column: value}, and updates the trial's bests."""
+        values = [metrics.get(column) for column in EPOCH_COLUMNS]
+        with self.lock, self.conn:
+            self.conn.execute(f"INSERT OR REPLACE INTO epochs (key, epoch, {', '.join(EPOCH_COLUMNS)}) "
+                              f"VALUES (?, ?, {', '.join('?' * len(EPOCH_COLUMNS))})", [key, epoch] + values)
+            self.conn.execute('UPDATE trials SET epochs = ?, '
+                              'best_val_acc = MAX(COALESCE(best_val_acc, ?), ?), '
+                              'best_val_loss = MIN(COALESCE(best_val_loss, ?), ?) WHERE key = ?',
+                              (epoch, metrics['val_acc'], metrics['val_acc'],
+                               metrics['val_loss'], metrics['val_loss'], key))
+
+    def finish_trial(self, key, status='completed', pruned_at=None):
+        """Marks a trial as 'completed', 'pruned' (at epoch `pruned_at`) or 'failed'."""
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE trials SET status = ?, pruned_at = ?, finished_at = ? WHERE key = ?',
+                              (status, pruned_at, time.time(), key))
+
+    def done_keys(self):
+        """Returns the keys of the trials that finished (completed or pruned)."""
+        with self.lock:
+            rows = self.conn.execute(f"SELECT key FROM trials WHERE status IN ({', '.join('?' * len(DONE_STATUSES))})",
+                                     DONE_STATUSES).fetchall()
+        return {key for key, in rows}
+
+    def is_done(self, params):
+        return params_key(params) in self.done_keys()
+
+    def _results(self, where='', args=(), order='', limit=None):
+        query = ('SELECT key, params, status, model_path, best_val_acc, best_val_loss, epochs, pruned_at '
+                 f'FROM trials {where} {order}')
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        with self.lock:
+            rows = self.conn.execute(query, args).fetchall()
+            results = []
+            for key, params, status, model_path, best_val_acc, best_val_loss, epochs, pruned_at in rows:
+                metrics = {column: [] for column in EPOCH_COLUMNS}
+                for values in self.conn.execute(f"SELECT {', '.join(EPOCH_COLUMNS)} FROM epochs "
+                                                'WHERE key = ? ORDER BY epoch', (key,)):
+                    for column, value in zip(EPOCH_COLUMNS, values):
+                        metrics[column].append(value)
+                results.append({'key': key, 'params': json.loads(params), 'status': status, 'model_path': model_path,
+                                'best_val_acc': best_val_acc, 'best_val_loss': best_val_loss, 'epochs': epochs,
+                                'pruned_at': pruned_at,
+                                'metrics': {column: values for column, values in metrics.items()
+                                            if any(value is not None for value in values)}})
+        return results
+
+    def get(self, params):
+        """Returns the result of the trial with these hyperparameters, or None."""
+        results = self._results('WHERE key = ?', (params_key(params),))
+        return results[0] if results else None
+
+    def results(self, statuses=DONE_STATUSES):
+        """Returns the results of the trials with one of `statuses` (every trial if None)."""
+        if statuses is None:
+            return self._results(order='ORDER BY started_at')
+        return self._results(f"WHERE status IN ({', '.join('?' * len(statuses))})", tuple(statuses),
+                             order='ORDER BY started_at')
+
+    def best(self, metric='best_val_acc', n=1, statuses=DONE_STATUSES):
+        """Returns the `n` best results by 'best_val_acc' (highest first) or 'best_val_loss' (lowest first)."""
+        if metric not in RANKED_METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        return self._results(f"WHERE status IN ({', '.join('?' * len(statuses))}) AND {metric} IS NOT NULL",
+                             tuple(statuses), order=f'ORDER BY {metric} {RANKED_METRICS[metric]}', limit=n)
+
+    def rung_values(self, epoch):
+        """Returns the best validation accuracy up to `epoch` of every trial that trained at least `epoch` epochs."""
+        with self.lock:
+            rows = self.conn.execute('SELECT MAX(val_acc) FROM epochs WHERE epoch <= ? GROUP BY key '
+                                     'HAVING MAX(epoch) >= ?', (epoch, epoch)).fetchall()
+        return [value for value, in rows]
+
+    def import_json(self, folder):
+        """
+        Adds the trials of the results_*.json files of the notebooks as completed trials. Each file
+        holds a list of results (the notebooks rewrote the whole list after every trial), so a trial
+        found in several files is imported once. Returns the number of trials imported.
+        """
+        results = {}
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.endswith('.json'):
+                with open(os.path.join(folder, file_name), 'r') as f:
+                    for result in json.load(f):
+                        results[params_key(result['params'])] = result
+        for result in results.values():
+            key = self.start_trial(result['params'], model_path=result.get('model_path'))
+            n_epochs = len(result['metrics']['val_acc'])
+            for epoch in range(n_epochs):
+                self.log_epoch(key, epoch + 1, {column: result['metrics'][column][epoch]
+                                                for column in EPOCH_COLUMNS if column in result['metrics']})
+            self.finish_trial(key, status='completed')
+        return len(results)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the grid search results store.")
+    parser.add_argument('--db', default=results_db_file)
+    parser.add_argument('--import-json', default=None, metavar='FOLDER',
+                        help=f"Import the notebooks' results_*.json files first (e.g. {results_folder}).")
+    parser.add_argument('--metric', choices=sorted(RANKED_METRICS), default='best_val_acc')
+    parser.add_argument('--top', type=int, default=5)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.import_json:
+        print(f"Imported {store.import_json(args.import_json)} trials from {args.import_json}")
+    for result in store.best(args.metric, n=args.top):
+        print(f"{result['key']} {result['status']:<9} epochs={result['epochs']:<3} "
+              f"val_acc={result['best_val_acc']:.4f} val_loss={result['best_val_loss']:.4f} {result['params']}")
+    store.close()
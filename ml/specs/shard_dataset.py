@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import argparse
+import h5py
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'transform'))
+from spec_storage import decode_spectrograms
+
+# Split files produced by split_specs.py and the shard directories they are converted to
+splits = {
+    '/Users/elcachorrohumano/workspace/MusicNN/data/train/spec_train.h5':
+        '/Users/elcachorrohumano/workspace/MusicNN/data/train/spec_train_shards',
+    '/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5':
+        '/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation_shards',
+    '/Users/elcachorrohumano/workspace/MusicNN/data/test/spec_test.h5':
+        '/Users/elcachorrohumano/workspace/MusicNN/data/test/spec_test_shards',
+}
+
+# Number of spectrograms per shard (about 680 MB of float32 30-second clips)
+rows_per_shard = 1024
+
+INDEX_FILE = 'index.npz'
+
+
+# Function to convert an HDF5 split file into fixed-size .npy shards plus an index
+def convert_h5_to_shards(h5_file, output_dir, rows_per_shard=1024):
+    """
+    Writes the spectrograms of `h5_file` to <output_dir>/shard_<n>.npy, `rows_per_shard` rows each
+    (the last shard holds the rest), one shard in memory at a time.
+
+    Values are kept in the storage type of the HDF5 file (float32, float16 or uint8, see
+    spec_storage.py). index.npz holds the song IDs, names and labels, the shard and offset of every
+    row, and the storage attributes as JSON.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with h5py.File(h5_file, 'r') as f:
+        spectrograms = f['spectrograms']
+        n_rows = len(spectrograms)
+        shard_files = []
+        for shard, start in enumerate(range(0, n_rows, rows_per_shard)):
+            block = spectrograms[start:start + rows_per_shard]
+            shard_file = f"shard_{shard:05d}.npy"
+            np.save(os.path.join(output_dir, shard_file), block)
+            shard_files.append(shard_file)
+
+        rows = np.arange(n_rows)
+        np.savez(os.path.join(output_dir, INDEX_FILE),
+                 song_ids=f['song_ids'][:].astype(str),
+                 song_names=f['song_names'].asstr()[:].astype(str) if 'song_names' in f else np.array([''] * n_rows),
+                 labels=f['labels'][:].astype(np.int64),
+                 shards=(rows // rows_per_shard).astype(np.int32),
+                 offsets=(rows % rows_per_shard).astype(np.int32),
+                 shard_files=np.array(shard_files),
+                 storage_attrs=json.dumps({key: (value.item() if hasattr(value, 'item') else value)
+                                           for key, value in spectrograms.attrs.items()}))
+    return len(shard_files)
+
+
+class ShardDataset(Dataset):
+    """
+    Spectrogram dataset over the memory-mapped .npy shards written by convert_h5_to_shards.
+
+    Shards are opened with np.load(mmap_mode='c') in each process, so every process reading a split
+    (DataLoader workers, training, scoring) shares one copy in the page cache. A sample is a view of
+    its shard, wrapped with torch.from_numpy without copying; float16 and uint8 shards are decoded to
+    float32 on read. Exposes the same `shape`, `labels` and `song_ids` as H5SpectrogramDataset.
+
+    Indexing with a list of indices returns a whole (batch, 1, height, width) tensor: rows that are
+    contiguous in one shard are a view, others are gathered with one copy. make_shard_loader uses it
+    to skip the per-sample collation of the default DataLoader.
+
+    Parameters:
+        directory (str): Directory written by convert_h5_to_shards.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with np.load(os.path.join(directory, INDEX_FILE)) as index:
+            self.song_ids = index['song_ids']
+            self.song_names = index['song_names']
+            labels = index['labels']
+            self.shard_of = index['shards']
+            self.offset_of = index['offsets']
+            self.shard_files = list(index['shard_files'])
+            self.storage_attrs = json.loads(str(index['storage_attrs']))
+        self.labels = torch.tensor(labels, dtype=torch.long)
+        first_shard = np.load(os.path.join(directory, self.shard_files[0]), mmap_mode='r')
+        self.shape = (len(labels), 1) + first_shard.shape[1:]
+        self._shards = None
+        self._pid = None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getstate__(self):
+        # Memory maps would be pickled as copies of their data, so each process opens its own
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        state['_pid'] = None
+        return state
+
+    def shards(self):
+        if self._shards is None or self._pid != os.getpid():
+            # Copy-on-write maps are writable, which torch.from_numpy needs, without ever touching the files
+            self._shards = [np.load(os.path.join(self.directory, shard_file), mmap_mode='c')
+                            for shard_file in self.shard_files]
+            self._pid = os.getpid()
+        return self._shards
+
+    def _batch(self, indices):
+        shards = self.shards()
+        shard_ids = self.shard_of[indices]
+        offsets = self.offset_of[indices]
+        first = offsets[0]
+        if (shard_ids == shard_ids[0]).all() and (offsets == np.arange(first, first + len(indices))).all():
+            batch = shards[shard_ids[0]][first:first + len(indices)]
+        else:
+            batch = np.empty((len(indices),) + self.shape[2:], dtype=shards[0].dtype)
+            for i, (shard, offset) in enumerate(zip(shard_ids, offsets)):
+                batch[i] = shards[shard][offset]
+        return torch.from_numpy(decode_spectrograms(batch, self.storage_attrs)).unsqueeze(1)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            spectrogram = self.shards()[self.shard_of[index]][self.offset_of[index]]
+            return torch.from_numpy(decode_spectrograms(spectrogram, self.storage_attrs)).unsqueeze(0), self.labels[index]
+        indices = np.asarray(index, dtype=np.int64)
+        return self._batch(indices), self.labels[torch.from_numpy(indices)]
+
+    def __getitems__(self, indices):
+        # Called by make_loader's DataLoader with a whole batch, which then collates the samples
+        spectrograms, labels = self[indices]
+        return list(zip(spectrograms, labels))
+
+
+# Function to build a DataLoader that takes whole batches from the shards, without per-sample collation
+def make_shard_loader(dataset, batch_size=64, shuffle=False, num_workers=0, prefetch_factor=2, drop_last=False):
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = {'prefetch_factor': prefetch_factor, 'persistent_workers': True}
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last), batch_size=None,
+                      num_workers=num_workers, **kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert HDF5 spectrogram splits to memory-mapped .npy shards.")
+    parser.add_argument('--split', nargs=2, action='append', metavar=('H5_FILE', 'OUTPUT_DIR'),
+                        help="HDF5 split and shard directory (can be repeated). Defaults to train, validation and test.")
+    parser.add_argument('--rows-per-shard', type=int, default=rows_per_shard)
+    args = parser.parse_args()
+
+    for h5_file, output_dir in (args.split or splits.items()):
+        n_shards = convert_h5_to_shards(h5_file, output_dir, rows_per_shard=args.rows_per_shard)
+        print(f"{h5_file} converted to {n_shards} shards in {output_dir}")
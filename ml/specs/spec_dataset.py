@@ -0,0 +1,110 @@
+import os
+import sys
+import h5py
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'transform'))
+from spec_storage import decode_spectrograms
+
+
+class H5SpectrogramDataset(Dataset):
+    """
+    Spectrogram dataset that reads samples from an HDF5 split file on demand.
+
+    Only the labels and song IDs are loaded up front; spectrograms are read when a sample or a batch
+    is requested, so training and scoring can start right away on splits bigger than RAM. The file is
+    opened lazily in each process, which makes the dataset safe to use with DataLoader workers.
+    Files written with float16 or 8-bit quantized storage (spec_storage.py) are decoded to float32 dB.
+
+    Parameters:
+        filepath (str): Path to an HDF5 file with 'spectrograms', 'labels' and 'song_ids' datasets.
+        rows (array): Optional row indices of the file to expose (e.g. 'splits/train' of the master file).
+        cache_bytes (int): Size of the HDF5 chunk cache of each open handle.
+    """
+
+    def __init__(self, filepath, rows=None, cache_bytes=64 * 1024 ** 2):
+        self.filepath = filepath
+        self.cache_bytes = cache_bytes
+        with h5py.File(filepath, 'r') as f:
+            n_rows, height, width = f['spectrograms'].shape
+            self.storage_attrs = dict(f['spectrograms'].attrs)
+            labels = f['labels'][:]
+            song_ids = f['song_ids'][:].astype(str)
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        if self.rows is not None:
+            labels = labels[self.rows]
+            song_ids = song_ids[self.rows]
+            n_rows = len(self.rows)
+        # Same shape as the (N, 1, height, width) tensors the notebooks used to build
+        self.shape = (n_rows, 1, height, width)
+        self.labels = torch.tensor(labels, dtype=torch.long)
+        self.song_ids = song_ids
+        self._file = None
+        self._pid = None
+
+    @classmethod
+    def from_split_index(cls, master_file, split, **kwargs):
+        """Builds the dataset of a split stored as row indices in the master file (split_specs.py 'index' mode)."""
+        with h5py.File(master_file, 'r') as f:
+            rows = f['splits'][split][:]
+        return cls(master_file, rows=rows, **kwargs)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getstate__(self):
+        # Open HDF5 handles can't be pickled or shared across processes
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_pid'] = None
+        return state
+
+    def _spectrograms(self):
+        if self._file is None or self._pid != os.getpid():
+            self._file = h5py.File(self.filepath, 'r', rdcc_nbytes=self.cache_bytes)
+            self._pid = os.getpid()
+        return self._file['spectrograms']
+
+    def _read(self, file_rows):
+        """Reads the spectrograms of increasing file rows, as one slice when they are contiguous."""
+        spectrograms = self._spectrograms()
+        if len(file_rows) > 1 and file_rows[-1] - file_rows[0] == len(file_rows) - 1:
+            return spectrograms[file_rows[0]:file_rows[-1] + 1]
+        # With one chunk per sample, reading row by row into one array is much faster than a fancy selection
+        batch = np.empty((len(file_rows),) + spectrograms.shape[1:], dtype=spectrograms.dtype)
+        for i, row in enumerate(file_rows):
+            spectrograms.read_direct(batch, np.s_[row], np.s_[i])
+        return batch
+
+    def __getitem__(self, index):
+        row = index if self.rows is None else self.rows[index]
+        spectrogram = torch.from_numpy(decode_spectrograms(self._spectrograms()[row], self.storage_attrs)).unsqueeze(0)
+        return spectrogram, self.labels[index]
+
+    def __getitems__(self, indices):
+        # Called by the DataLoader with a whole batch: one HDF5 read instead of one per sample
+        indices = np.asarray(indices, dtype=np.int64)
+        file_rows = indices if self.rows is None else self.rows[indices]
+        unique_rows, inverse = np.unique(file_rows, return_inverse=True)
+        spectrograms = self._read(unique_rows)[inverse]
+        spectrograms = torch.from_numpy(decode_spectrograms(spectrograms, self.storage_attrs)).unsqueeze(1)
+        labels = self.labels[torch.from_numpy(indices)]
+        return list(zip(spectrograms, labels))
+
+
+# Function to open a spectrogram split: an HDF5 file, or a directory of .npy shards (shard_dataset.py)
+def open_dataset(path):
+    if os.path.isdir(path):
+        from shard_dataset import ShardDataset
+        return ShardDataset(path)
+    return H5SpectrogramDataset(path)
+
+
+# Function to build a DataLoader that reads batches from the HDF5 file and prefetches them in worker processes
+def make_loader(dataset, batch_size=64, shuffle=False, num_workers=0, prefetch_factor=2):
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = {'prefetch_factor': prefetch_factor, 'persistent_workers': True}
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers, **kwargs)
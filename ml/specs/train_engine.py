@@ -0,0 +1,223 @@
+import time
+import argparse
+from collections import defaultdict
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.optim.lr_scheduler import ReduceLROnPlateau
+
+from cnn_model import ImprovedCNN
+from spec_dataset import open_dataset, make_loader
+
+# File paths
+train_data_path = '/Users/elcachorrohumano/workspace/MusicNN/data/train/spec_train.h5'
+val_data_path = '/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5'
+
+# Parameters of the best grid search model (model_9)
+conv_channels = [32, 64, 128]
+fc_units = [1024, 512]
+dropout_rate = 0.25
+learning_rate = 0.001
+weight_decay = 0.01
+
+
+# Function to set the number of CPU threads used by torch (intra-op, and inter-op if given)
+def configure_threads(num_threads=None, interop_threads=None):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        # Only allowed before the first parallel work of the process
+        torch.set_num_interop_threads(interop_threads)
+    return torch.get_num_threads()
+
+# Function to run one pass over a loader, training when an optimizer is given and evaluating otherwise
+def run_epoch(model, loader, criterion, device, optimizer=None, autocast_dtype=None, channels_last=False,
+              max_grad_norm=1.0, sync_every_batch=False):
+    """
+    Returns {'loss', 'acc', 'samples', 'seconds', 'samples_per_s'} for one epoch.
+
+    The loss and the number of correct predictions are accumulated in tensors on `device` and read
+    once at the end of the epoch, so the loop never waits for the device. `loss` is the mean of the
+    batch losses and `acc` the fraction of correct samples, as in the notebooks' train_model.
+    `sync_every_batch` reads them with .item() after every batch like the notebooks did, only to
+    measure what that costs.
+    """
+    training = optimizer is not None
+    model.train(training)
+    loss_sum = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    n_batches, n_samples = 0, 0
+
+    start = time.perf_counter()
+    with torch.set_grad_enabled(training):
+        for inputs, labels in loader:
+            inputs, labels = inputs.to(device, non_blocking=True), labels.to(device, non_blocking=True)
+            if channels_last:
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
+
+            with torch.autocast(device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                outputs = model(inputs)
+                loss = criterion(outputs, labels)
+
+            if training:
+                optimizer.zero_grad(set_to_none=True)
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=max_grad_norm)
+                optimizer.step()
+
+            batch_correct = (outputs.argmax(dim=1) == labels).sum()
+            if sync_every_batch:
+                loss_sum += loss.item()
+                correct += batch_correct.item()
+            else:
+                loss_sum += loss.detach().float()
+                correct += batch_correct
+            n_batches += 1
+            n_samples += labels.size(0)
+
+    epoch_loss = loss_sum.item() / n_batches
+    epoch_acc = correct.item() / n_samples
+    seconds = time.perf_counter() - start
+    return {'loss': epoch_loss, 'acc': epoch_acc, 'samples': n_samples, 'seconds': seconds,
+            'samples_per_s': n_samples / seconds}
+
+# Function to get the layout, precision and compilation options of a training run
+def prepare_model(model, device, channels_last=False, compile_model=False):
+    """Returns (model, runnable): `model` holds the weights to save, `runnable` is what the loop calls."""
+    model = model.to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    runnable = torch.compile(model) if compile_model else model
+    return model, runnable
+
+# Function to train a model with early stopping on the validation loss
+def train_model(model, train_loader, val_loader, criterion, optimizer, scheduler, device,
+                max_epochs=30, patience=5, model_path='model.pth', autocast_dtype=None, channels_last=False,
+                compile_model=False, max_grad_norm=1.0, verbose=True, epoch_callback=None):
+    """
+    Drop-in replacement of the notebooks' train_model, returning the same per-epoch metrics
+    ('train_loss', 'val_loss', 'train_acc', 'val_acc') plus 'epoch_time' and 'train_samples_per_s'.
+
+    The best weights (lowest validation loss) are saved to `model_path`; training stops after
+    `patience` epochs without improvement.
+
+    Parameters:
+        autocast_dtype (torch.dtype): Run the forward pass under autocast, e.g. torch.bfloat16 on CPU.
+        channels_last (bool): Store the weights and inputs in NHWC layout (faster convolutions on CPU).
+        compile_model (bool): Run the model through torch.compile (the first epoch includes compilation).
+        epoch_callback (callable): Called as epoch_callback(epochs_done, metrics) after every epoch;
+                                   returning True stops training (e.g. a pruned grid search trial).
+    """
+    device = torch.device(device)
+    model, runnable = prepare_model(model, device, channels_last=channels_last, compile_model=compile_model)
+    options = {'autocast_dtype': autocast_dtype, 'channels_last': channels_last}
+
+    train_metrics = defaultdict(list)
+    best_val_loss = float('inf')
+    patience_counter = 0
+
+    for epoch in range(max_epochs):
+        start = time.perf_counter()
+        train = run_epoch(runnable, train_loader, criterion, device, optimizer=optimizer,
+                          max_grad_norm=max_grad_norm, **options)
+        val = run_epoch(runnable, val_loader, criterion, device, **options)
+        epoch_time = time.perf_counter() - start
+
+        scheduler.step(val['loss'])
+
+        train_metrics['train_loss'].append(train['loss'])
+        train_metrics['val_loss'].append(val['loss'])
+        train_metrics['train_acc'].append(train['acc'])
+        train_metrics['val_acc'].append(val['acc'])
+        train_metrics['epoch_time'].append(epoch_time)
+        train_metrics['train_samples_per_s'].append(train['samples_per_s'])
+
+        if verbose:
+            print(f"Epoch {epoch + 1}/{max_epochs} ({epoch_time:.1f}s, {train['samples_per_s']:.1f} train samples/s)")
+            print(f"Train Loss: {train['loss']:.4f}, Train Acc: {train['acc']:.4f}")
+            print(f"Val Loss: {val['loss']:.4f}, Val Acc: {val['acc']:.4f}")
+
+        if val['loss'] < best_val_loss:
+            best_val_loss = val['loss']
+            torch.save(model.state_dict(), model_path)
+            patience_counter = 0
+        else:
+            patience_counter += 1
+
+        # The callback sees every epoch, including the one that triggers early stopping
+        if epoch_callback is not None and epoch_callback(epoch + 1, train_metrics):
+            if verbose:
+                print(f"Stopped by the epoch callback at epoch {epoch + 1}")
+            break
+
+        if patience_counter >= patience:
+            if verbose:
+                print(f"Early stopping triggered at epoch {epoch + 1}")
+            break
+
+    return train_metrics
+
+# Function to build ImprovedCNN with its optimizer and scheduler as in the grid search
+def build_training(params, height, width, num_classes):
+    model = ImprovedCNN(height, width, num_classes,
+                        conv_channels=params['conv_channels'],
+                        fc_units=params['fc_units'],
+                        dropout_rate=params['dropout_rate'])
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.AdamW(model.parameters(), lr=params['learning_rate'], weight_decay=params['weight_decay'])
+    scheduler = ReduceLROnPlateau(optimizer, mode='min', factor=0.5, patience=3)
+    return model, criterion, optimizer, scheduler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train ImprovedCNN and report epoch time and samples/s.")
+    parser.add_argument('--train', default=train_data_path)
+    parser.add_argument('--val', default=val_data_path)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=None, help="Number of intra-op CPU threads.")
+    parser.add_argument('--workers', type=int, default=0, help="DataLoader worker processes.")
+    parser.add_argument('--bf16', action='store_true', help="bfloat16 autocast (CPU).")
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--compile', action='store_true')
+    parser.add_argument('--baseline', action='store_true',
+                        help="Also time the notebook loop (fp32, NCHW, .item() after every batch) for comparison.")
+    parser.add_argument('--model-path', default='model_engine.pth')
+    args = parser.parse_args()
+
+    print(f"Using {configure_threads(args.threads)} CPU threads")
+    device = torch.device('cpu')
+    train_dataset, val_dataset = open_dataset(args.train), open_dataset(args.val)
+    train_loader = make_loader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.workers)
+    val_loader = make_loader(val_dataset, batch_size=args.batch_size, num_workers=args.workers)
+    _, _, height, width = train_dataset.shape
+    num_classes = len(set(train_dataset.labels.numpy()))
+    params = {'conv_channels': conv_channels, 'fc_units': fc_units, 'dropout_rate': dropout_rate,
+              'learning_rate': learning_rate, 'weight_decay': weight_decay}
+
+    runs = {'engine': {'autocast_dtype': torch.bfloat16 if args.bf16 else None,
+                       'channels_last': args.channels_last, 'compile_model': args.compile}}
+    if args.baseline:
+        runs = {'baseline': None, **runs}
+
+    for name, options in runs.items():
+        torch.manual_seed(0)
+        model, criterion, optimizer, scheduler = build_training(params, height, width, num_classes)
+        if options is None:
+            # The notebook loop: no engine options and a sync after every batch
+            model = model.to(device)
+            times = []
+            for epoch in range(args.epochs):
+                train = run_epoch(model, train_loader, criterion, device, optimizer=optimizer, sync_every_batch=True)
+                val = run_epoch(model, val_loader, criterion, device, sync_every_batch=True)
+                times.append((train['seconds'] + val['seconds'], train['samples_per_s']))
+        else:
+            metrics = train_model(model, train_loader, val_loader, criterion, optimizer, scheduler, device,
+                                  max_epochs=args.epochs, patience=args.epochs, model_path=args.model_path,
+                                  verbose=False, **options)
+            times = list(zip(metrics['epoch_time'], metrics['train_samples_per_s']))
+        # The first epoch includes warm-up (and compilation), so report the later ones when there are any
+        steady = times[1:] or times
+        print(f"{name}: {sum(t for t, _ in steady) / len(steady):.2f}s per epoch, "
+              f"{sum(s for _, s in steady) / len(steady):.1f} train samples/s "
+              f"(first epoch {times[0][0]:.2f}s)")
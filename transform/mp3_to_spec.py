@@ -1,87 +1,310 @@
 import os
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import librosa
 import numpy as np
 import h5py
-import pandas as pd
+from spec_cache import SpectrogramCache
+from spec_storage import create_spectrogram_dataset, encode_spectrograms
+from track_index import TrackIndex
 
 # Paths
 data_dir = '/Users/elcachorrohumano/workspace/MusicNN/data/audio_samples'
 output_file = '/Users/elcachorrohumano/workspace/MusicNN/data/spectrograms.h5'
+cache_file = '/Users/elcachorrohumano/workspace/MusicNN/data/spectrogram_cache.h5'
 csv_file = '/Users/elcachorrohumano/workspace/MusicNN/data/tracks_audio_features_with_names.csv'
 
-# Load the CSV file with song IDs and track names
-df = pd.read_csv(csv_file)
+# Number of worker processes used to decode the MP3s (None uses every core)
+n_workers = None
 
-# Initialize lists to store spectrograms, labels, song names, and IDs
-spectrograms = []
-labels = []
-song_names = []
-song_ids = []
-spectrogram_lengths = []
+# How the spectrograms are stored: 'float32', 'float16' or 'uint8' (see spec_storage.py), and the HDF5 codec
+storage = 'float32'
+compression = None
+
+# Value used for frames past the end of a clip (power_to_db with ref=np.max and top_db=80 floors at -80 dB)
+PAD_DB = -80.0
 
 # Function to create a spectrogram from an MP3 file
-def get_spectrogram(file_path, n_mels=128):
-    y, sr = librosa.load(file_path)
-    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels)
+def get_spectrogram(file_path, n_mels=128, sr=22050, hop_length=512):
+    y, sr = librosa.load(file_path, sr=sr)
+    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, hop_length=hop_length)
     S_db = librosa.power_to_db(S, ref=np.max)
     return S_db
 
-# Iterate through each folder ('0' and '1') to find the minimum spectrogram length
-for label in ['0', '1']:
-    folder_path = os.path.join(data_dir, label)
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith('.mp3'):
-            file_path = os.path.join(folder_path, file_name)
-            print(f"Processing {file_path}")
-            spectrogram = get_spectrogram(file_path)
-            
-            # Store the spectrogram length
-            spectrogram_lengths.append(spectrogram.shape[1])
-
-# Find the minimum length of the spectrograms
-min_length = min(spectrogram_lengths)
-
-# Iterate again to truncate spectrograms and store them along with names and IDs
-for label in ['0', '1']:
-    folder_path = os.path.join(data_dir, label)
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith('.mp3'):
-            file_path = os.path.join(folder_path, file_name)
-            spectrogram = get_spectrogram(file_path)
-            
-            # Truncate the spectrogram to the minimum length
-            truncated_spectrogram = spectrogram[:, :min_length]
-            
+# Function to list the MP3 files of each label folder ('0' and '1') in a deterministic order
+def list_audio_files(data_dir, labels=('0', '1')):
+    files = []
+    for label in labels:
+        folder_path = os.path.join(data_dir, label)
+        for file_name in sorted(os.listdir(folder_path)):
+            if file_name.endswith('.mp3'):
+                files.append((os.path.join(folder_path, file_name), int(label)))
+    return files
+
+# Function run in the worker processes: decodes one file and returns the error instead of raising it
+def _extract_one(file_path, n_mels, sr, hop_length):
+    try:
+        return file_path, get_spectrogram(file_path, n_mels=n_mels, sr=sr, hop_length=hop_length), None
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}"
+
+# Function to retry a single file in its own process after it may have crashed a worker
+def _extract_isolated(file_path, mel_args, context):
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        try:
+            return executor.submit(_extract_one, file_path, *mel_args).result()
+        except BrokenProcessPool:
+            return file_path, None, "Worker process crashed while decoding the file"
+
+# Function to decode MP3 files into spectrograms on a pool of worker processes
+def extract_spectrograms(file_paths, n_mels=128, sr=22050, hop_length=512, n_workers=None, max_pending=None):
+    """
+    Decodes MP3 files in parallel and yields (file_path, spectrogram, error) in the order of `file_paths`.
+
+    A file that cannot be decoded yields a None spectrogram and the error message instead of stopping
+    the run. If a file takes its worker process down, it is retried alone so only that file is marked
+    as failed. At most `max_pending` files are in flight, so memory stays bounded on large corpora.
+
+    Parameters:
+        file_paths (iterable): Paths of the MP3 files to decode.
+        n_mels (int): Number of mel bands.
+        sr (int): Sampling rate the audio is resampled to.
+        hop_length (int): Number of samples between STFT frames.
+        n_workers (int): Number of worker processes (defaults to the number of cores, 1 runs in-process).
+        max_pending (int): Maximum number of submitted files not yet yielded (defaults to 4 per worker).
+    """
+    mel_args = (n_mels, sr, hop_length)
+    n_workers = n_workers or os.cpu_count()
+    if n_workers == 1:
+        for file_path in file_paths:
+            yield _extract_one(file_path, *mel_args)
+        return
+
+    # Keep each worker on one BLAS/OpenMP thread so the processes don't oversubscribe the cores.
+    # Spawned workers inherit the environment before they import numpy.
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMBA_NUM_THREADS'):
+        os.environ.setdefault(var, '1')
+
+    context = mp.get_context('spawn')
+    max_pending = max_pending or 4 * n_workers
+    paths = iter(file_paths)
+    pending = deque()
+    executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context)
+    try:
+        while True:
+            while len(pending) < max_pending:
+                file_path = next(paths, None)
+                if file_path is None:
+                    break
+                pending.append((file_path, executor.submit(_extract_one, file_path, *mel_args)))
+            if not pending:
+                break
+
+            file_path, future = pending.popleft()
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # Every pending future fails with the pool, so retry the oldest alone and resubmit the rest
+                executor.shutdown(wait=False, cancel_futures=True)
+                result = _extract_isolated(file_path, mel_args, context)
+                executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context)
+                pending = deque((path, executor.submit(_extract_one, path, *mel_args)) for path, _ in pending)
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# Function to serve spectrograms from the cache, decoding only the files that are new or changed
+def cached_spectrograms(file_paths, cache, n_mels=128, sr=22050, hop_length=512, n_workers=None, frontend=None):
+    """
+    Yields (file_path, spectrogram, error) in the order of `file_paths`, like extract_spectrograms.
+
+    Files whose content hash and mel parameters are already in `cache` are read from it. The rest are
+    decoded in parallel (or with `frontend`, which the cache must have been opened with) and added to
+    the cache, and entries whose source files are gone are dropped.
+    """
+    keys = {file_path: cache.key(file_path) for file_path in file_paths}
+    missing = [file_path for file_path, key in keys.items() if key not in cache]
+    print(f"{len(keys) - len(missing)} spectrograms cached, {len(missing)} to decode")
+
+    errors = {}
+    if frontend is not None:
+        results = frontend.extract(missing)
+    else:
+        results = extract_spectrograms(missing, n_mels=n_mels, sr=sr, hop_length=hop_length, n_workers=n_workers)
+    for file_path, spectrogram, error in results:
+        if error is not None:
+            errors[file_path] = error
+        else:
+            cache.put(keys[file_path], spectrogram, source=file_path)
+
+    removed = cache.prune(set(keys.values()))
+    if removed:
+        print(f"Dropped {removed} cached spectrograms whose source files are gone or changed")
+
+    for file_path, key in keys.items():
+        if file_path in errors:
+            yield file_path, None, errors[file_path]
+        else:
+            yield file_path, cache.get(key), None
+
+
+class SpectrogramWriter:
+    """
+    Streams spectrograms into a resizable, chunked HDF5 dataset one clip at a time.
+
+    Spectrograms are appended as they are decoded, so only one of them is held in memory.
+    Clips can have different lengths: the dataset grows to the longest clip seen so far and
+    shorter clips are padded with PAD_DB. The length policy is applied once in `finalize`.
+    Labels, song names and IDs are small and are written when the writer is closed.
+    With `storage` and `compression`, the spectrograms are stored as float16 or 8-bit quantized dB
+    values and compressed (see spec_storage.py); the loaders decode them transparently.
+    """
+
+    def __init__(self, output_file, n_mels=128, storage='float32', compression=None):
+        self.output_file = output_file
+        self.n_mels = n_mels
+        self.storage = storage
+        self.compression = compression
+        self.file = h5py.File(output_file, 'w')
+        self.spectrograms = None
+        self.lengths = []
+        self.labels = []
+        self.song_names = []
+        self.song_ids = []
+        self.failed_files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def append(self, spectrogram, label, song_name, song_id):
+        n_frames = spectrogram.shape[1]
+        if self.spectrograms is None:
+            # One chunk per clip (sized on the first clip) keeps single-sample reads cheap
+            self.spectrograms = create_spectrogram_dataset(
+                self.file, shape=(0, self.n_mels, n_frames), maxshape=(None, self.n_mels, None),
+                storage=self.storage, compression=self.compression, fill_db=PAD_DB)
+            self.storage_attrs = dict(self.spectrograms.attrs)
+
+        row = len(self.lengths)
+        self.spectrograms.resize(row + 1, axis=0)
+        if n_frames > self.spectrograms.shape[2]:
+            self.spectrograms.resize(n_frames, axis=2)
+        self.spectrograms[row, :, :n_frames] = encode_spectrograms(spectrogram, self.storage_attrs)
+
+        self.lengths.append(n_frames)
+        self.labels.append(int(label))
+        self.song_names.append(str(song_name))
+        self.song_ids.append(song_id)
+
+    def record_failure(self, file_path, error):
+        self.failed_files.append(f"{file_path}: {error}")
+
+    def finalize(self, length_policy='truncate', length=None):
+        """
+        Applies the length policy to the stored spectrograms.
+
+        Parameters:
+            length_policy (str): 'truncate' cuts every clip to the shortest one (the original behaviour),
+                                 'pad' keeps the longest clip and pads the rest with PAD_DB,
+                                 'fixed' truncates or pads every clip to `length` frames.
+            length (int): Number of frames to keep when length_policy is 'fixed'.
+
+        Returns:
+            int: Number of frames per spectrogram after the policy is applied.
+        """
+        if self.spectrograms is None:
+            raise ValueError("No spectrograms were written.")
+
+        if length_policy == 'truncate':
+            target = min(self.lengths)
+        elif length_policy == 'pad':
+            target = max(self.lengths)
+        elif length_policy == 'fixed':
+            if length is None:
+                raise ValueError("A length must be given for the 'fixed' length policy.")
+            target = length
+        else:
+            raise ValueError(f"Unknown length policy: {length_policy}")
+
+        self.spectrograms.resize(target, axis=2)
+        return target
+
+    def close(self):
+        if not self.file:
+            return
+        # Use h5py's special string type for UTF-8 support
+        dt = h5py.string_dtype(encoding='utf-8')
+        self.file.create_dataset('labels', data=np.array(self.labels, dtype=np.int64))
+        self.file.create_dataset('song_names', data=self.song_names, dtype=dt)
+        self.file.create_dataset('song_ids', data=self.song_ids, dtype=dt)
+        self.file.create_dataset('lengths', data=np.array(self.lengths, dtype=np.int64))
+        self.file.create_dataset('failed_files', data=self.failed_files, dtype=dt)
+        self.file.close()
+
+
+# Function to decode every MP3 once and stream the spectrograms into the HDF5 file
+def build_spectrograms(data_dir, output_file, csv_file, n_mels=128, length_policy='truncate', length=None,
+                       n_workers=None, cache_file=None, sr=22050, hop_length=512, frontend=None, storage='float32',
+                       compression=None):
+    # Index the CSV file with song IDs and track names
+    tracks = TrackIndex.from_csv(csv_file)
+
+    audio_files = list_audio_files(data_dir)
+    file_labels = dict(audio_files)
+    file_paths = [file_path for file_path, _ in audio_files]
+
+    # With a cache file, only new or changed MP3s are decoded (with the front-end, if one is given)
+    if cache_file is not None:
+        cache = SpectrogramCache(cache_file, n_mels=n_mels, sr=sr, hop_length=hop_length, frontend=frontend)
+        results = cached_spectrograms(file_paths, cache, n_mels=n_mels, sr=sr, hop_length=hop_length,
+                                      n_workers=n_workers, frontend=frontend)
+    elif frontend is not None:
+        # Batched front-end (mel_frontend.MelFrontend): decodes in this process, computes many clips per call
+        cache = None
+        results = frontend.extract(file_paths)
+    else:
+        cache = None
+        results = extract_spectrograms(file_paths, n_mels=n_mels, sr=sr, hop_length=hop_length, n_workers=n_workers)
+
+    with SpectrogramWriter(output_file, n_mels=n_mels, storage=storage, compression=compression) as writer:
+        for file_path, spectrogram, error in results:
+            if error is not None:
+                print(f"Skipping {file_path}: {error}")
+                writer.record_failure(file_path, error)
+                continue
+            print(f"Processed {file_path}")
+            label = file_labels[file_path]
+
             # Extract the song ID from the filename (assuming filename is the ID)
-            song_id = os.path.splitext(file_name)[0]
-            
+            song_id = os.path.splitext(os.path.basename(file_path))[0]
+
             # Look up the corresponding track name from the CSV using the song ID
-            row = df[df['id'] == song_id]
-            if not row.empty:
-                song_name = row['track_name'].values[0]
+            if song_id in tracks:
+                song_name = tracks.get(song_id, 'track_name')
             else:
                 song_name = ''  # Use empty string if no match found
                 print(f"Song ID '{song_id}' not found in the CSV.")
-            
-            # Store the truncated spectrogram, label, song name, and ID
-            spectrograms.append(truncated_spectrogram)
-            labels.append(int(label))
-            song_names.append(song_name)
-            song_ids.append(song_id)  # Ensure song_id is stored as is
-
-# Convert to numpy arrays
-spectrograms = np.array(spectrograms)
-labels = np.array(labels)
-
-song_names = [str(name) for name in song_names]
-
-# Save to HDF5 file, using UTF-8 encoding for song names and IDs
-with h5py.File(output_file, 'w') as f:
-    f.create_dataset('spectrograms', data=spectrograms)
-    f.create_dataset('labels', data=labels)
-    # Use h5py's special string type for UTF-8 support
-    dt = h5py.string_dtype(encoding='utf-8')
-    f.create_dataset('song_names', data=song_names, dtype=dt)
-    f.create_dataset('song_ids', data=song_ids, dtype=dt)
-
-print(f"Spectrograms, labels, song names, and IDs saved to {output_file}")
+
+            writer.append(spectrogram, label, song_name, song_id)
+
+        n_frames = writer.finalize(length_policy, length)
+        print(f"{len(writer)} spectrograms stored with {n_frames} frames each ({length_policy})")
+        if writer.failed_files:
+            print(f"{len(writer.failed_files)} files could not be decoded, see 'failed_files' in {output_file}")
+
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == '__main__':
+    build_spectrograms(data_dir, output_file, csv_file, n_workers=n_workers, cache_file=cache_file, storage=storage,
+                       compression=compression)
+    print(f"Spectrograms, labels, song names, and IDs saved to {output_file}")
@@ -0,0 +1,113 @@
+import os
+import hashlib
+import numpy as np
+import h5py
+
+
+# Function to hash the content of a file without loading it whole
+def hash_file(file_path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SpectrogramCache:
+    """
+    Content-addressed HDF5 store of full-length (untruncated) spectrograms.
+
+    Each entry is keyed by the SHA-1 of the MP3 bytes plus the mel parameters, so a file is only
+    decoded again when its content or the parameters change. The file size and modification time
+    of every source are kept in an index, which lets unchanged files skip hashing on a rerun.
+
+    Layout of the cache file:
+        entries/<key>       float32 (n_mels, frames) spectrogram
+        index/paths         source file paths seen in the last run
+        index/sizes         file sizes in bytes
+        index/mtimes        modification times in nanoseconds
+        index/hashes        SHA-1 of each file's content
+
+    HDF5 does not give back the space of pruned entries; run h5repack on the cache file to shrink it.
+    With a `frontend` (mel_frontend.MelFrontend), its settings replace the mel parameters in the keys,
+    so its spectrograms and librosa's are never mixed up.
+    """
+
+    def __init__(self, cache_file, n_mels=128, sr=22050, hop_length=512, frontend=None):
+        self.cache_file = cache_file
+        self.params_tag = f"mels{n_mels}_sr{sr}_hop{hop_length}"
+        if frontend is not None:
+            self.params_tag = f"frontend_{frontend.cache_tag}"
+        self.file = h5py.File(cache_file, 'a')
+        self.entries = self.file.require_group('entries')
+        self.index = self._load_index()
+        self.seen = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load_index(self):
+        if 'index' not in self.file:
+            return {}
+        index = self.file['index']
+        paths = index['paths'].asstr()[:]
+        return {path: (int(size), int(mtime), content_hash)
+                for path, size, mtime, content_hash in zip(paths, index['sizes'][:], index['mtimes'][:],
+                                                            index['hashes'].asstr()[:])}
+
+    def key(self, file_path):
+        """Returns the cache key of a file, hashing it only if its size or modification time changed."""
+        stat = os.stat(file_path)
+        cached = self.index.get(file_path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            content_hash = cached[2]
+        else:
+            content_hash = hash_file(file_path)
+        self.seen[file_path] = (stat.st_size, stat.st_mtime_ns, content_hash)
+        return f"{content_hash}_{self.params_tag}"
+
+    def get(self, key):
+        return self.entries[key][:]
+
+    def put(self, key, spectrogram, source=''):
+        if key in self.entries:
+            del self.entries[key]
+        dataset = self.entries.create_dataset(key, data=np.asarray(spectrogram, dtype=np.float32))
+        dataset.attrs['source'] = source
+
+    def prune(self, keep_keys):
+        """
+        Drops the entries of files that are gone or changed, i.e. whose content hash is not in any of
+        `keep_keys` (the keys of the current files), and returns how many were removed. Entries of the
+        current files under other mel parameters or another front-end are kept.
+        """
+        keep_hashes = {key.split('_', 1)[0] for key in keep_keys}
+        stale = [key for key in self.entries if key.split('_', 1)[0] not in keep_hashes]
+        for key in stale:
+            del self.entries[key]
+        return len(stale)
+
+    def close(self):
+        if not self.file:
+            return
+        # Only the files looked up in this run are kept in the index, so removed files drop out of it
+        index = self.seen if self.seen else self.index
+        if 'index' in self.file:
+            del self.file['index']
+        group = self.file.create_group('index')
+        dt = h5py.string_dtype(encoding='utf-8')
+        paths = list(index)
+        group.create_dataset('paths', data=paths, dtype=dt)
+        group.create_dataset('sizes', data=np.array([index[p][0] for p in paths], dtype=np.int64))
+        group.create_dataset('mtimes', data=np.array([index[p][1] for p in paths], dtype=np.int64))
+        group.create_dataset('hashes', data=[index[p][2] for p in paths], dtype=dt)
+        self.file.close()
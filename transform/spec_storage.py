@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import h5py
+
+# Storage types of the 'spectrograms' dataset: 'float32' keeps the dB values as computed, 'float16' halves
+# the size (about 0.03 dB of rounding at -80 dB), 'uint8' quantizes the [-80, 0] dB range to 256 levels
+STORAGE_DTYPES = {'float32': np.float32, 'float16': np.float16, 'uint8': np.uint8}
+
+# dB range covered by 'uint8' (power_to_db with ref=np.max and top_db=80 gives values in [-80, 0])
+DB_MIN = -80.0
+DB_MAX = 0.0
+
+
+# Function to get the attributes describing how spectrograms are stored (written on the 'spectrograms' dataset)
+def storage_attrs(storage='float32'):
+    if storage not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown storage type: {storage}")
+    attrs = {'storage': storage}
+    if storage == 'uint8':
+        # Stored value q stands for q * db_scale + db_offset
+        attrs['db_scale'] = (DB_MAX - DB_MIN) / 255
+        attrs['db_offset'] = DB_MIN
+    return attrs
+
+# Function to convert float32 dB spectrograms to their stored representation
+def encode_spectrograms(spectrograms, attrs):
+    storage = attrs.get('storage', 'float32')
+    if storage == 'uint8':
+        quantized = np.rint((spectrograms - attrs['db_offset']) / attrs['db_scale'])
+        return np.clip(quantized, 0, 255).astype(np.uint8)
+    return np.asarray(spectrograms, dtype=STORAGE_DTYPES[storage])
+
+# Function to convert stored spectrograms back to float32 dB values
+def decode_spectrograms(stored, attrs):
+    storage = attrs.get('storage', 'float32')
+    if storage == 'uint8':
+        decoded = stored.astype(np.float32)
+        decoded *= np.float32(attrs['db_scale'])
+        decoded += np.float32(attrs['db_offset'])
+        return decoded
+    return stored.astype(np.float32, copy=False)
+
+# Function to create a 'spectrograms' dataset with one chunk per sample in the given storage type
+def create_spectrogram_dataset(f, shape, maxshape=None, storage='float32', compression=None, fill_db=None,
+                               name='spectrograms'):
+    """
+    Creates the spectrogram dataset of an HDF5 file and records its storage attributes.
+
+    Parameters:
+        f (h5py.File): Open file (or group) to create the dataset in.
+        shape (tuple): (rows, n_mels, frames).
+        maxshape (tuple): Maximum shape for resizable datasets.
+        storage (str): 'float32', 'float16' or 'uint8' (see STORAGE_DTYPES).
+        compression (str): HDF5 filter ('lzf' is fast, 'gzip' is smaller and slower) or None.
+        fill_db (float): dB value of the unwritten parts (e.g. the padding of shorter clips).
+    """
+    attrs = storage_attrs(storage)
+    kwargs = {}
+    if compression is not None:
+        # Byte shuffling groups the exponent bytes of float values, which compress much better
+        kwargs = {'compression': compression, 'shuffle': storage != 'uint8'}
+    if fill_db is not None:
+        kwargs['fillvalue'] = encode_spectrograms(np.float32(fill_db), attrs)
+    dataset = f.create_dataset(name, shape=shape, maxshape=maxshape, dtype=STORAGE_DTYPES[storage],
+                               chunks=(1,) + tuple(shape[1:]), **kwargs)
+    dataset.attrs.update(attrs)
+    return dataset
+
+# Function to copy a spectrogram file into another storage type and compression, `chunk_rows` rows at a time
+def convert_file(input_file, output_file, storage='float32', compression='lzf', chunk_rows=256):
+    with h5py.File(input_file, 'r') as f_in, h5py.File(output_file, 'w') as f_out:
+        source = f_in['spectrograms']
+        source_attrs = dict(source.attrs)
+        target = create_spectrogram_dataset(f_out, source.shape, storage=storage, compression=compression)
+        target_attrs = dict(target.attrs)
+        for start in range(0, len(source), chunk_rows):
+            block = decode_spectrograms(source[start:start + chunk_rows], source_attrs)
+            target[start:start + len(block)] = encode_spectrograms(block, target_attrs)
+        for name in f_in:
+            if name != 'spectrograms':
+                f_in.copy(f_in[name], f_out, name=name)
+
+
+# Function to measure bytes on disk, read speed and error of each storage option on one spectrogram file
+def benchmark(input_file, options, n_samples=512, batch_size=64, seed=0):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ml', 'specs'))
+    from spec_dataset import H5SpectrogramDataset
+
+    with h5py.File(input_file, 'r') as f:
+        n_rows = len(f['spectrograms'])
+        reference_attrs = dict(f['spectrograms'].attrs)
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(n_rows, size=min(n_samples, n_rows), replace=False))
+    random_rows = rng.permutation(sample_rows)
+
+    with h5py.File(input_file, 'r') as f:
+        reference = decode_spectrograms(f['spectrograms'][sample_rows], reference_attrs)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for storage, compression in options:
+            output_file = os.path.join(tmp_dir, f"{storage}_{compression}.h5")
+            convert_file(input_file, output_file, storage=storage, compression=compression)
+            dataset = H5SpectrogramDataset(output_file)
+
+            # One sample at a time in random order (DataLoader without batched reads), then in batches
+            start = time.perf_counter()
+            for row in random_rows:
+                dataset[int(row)]
+            single_rate = len(random_rows) / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for i in range(0, len(random_rows), batch_size):
+                dataset.__getitems__(random_rows[i:i + batch_size])
+            batch_rate = len(random_rows) / (time.perf_counter() - start)
+
+            decoded = dataset.__getitems__(sample_rows)
+            max_error = max(float(np.abs(spectrogram[0].numpy() - ref).max())
+                            for (spectrogram, _), ref in zip(decoded, reference))
+            results.append({'storage': storage, 'compression': compression or 'none',
+                            'bytes': os.path.getsize(output_file), 'single_per_s': single_rate,
+                            'batch_per_s': batch_rate, 'max_error_db': max_error})
+            del dataset  # Close the file before the temporary directory is removed
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare spectrogram storage options on one HDF5 split.")
+    parser.add_argument('input_file', help="spectrograms.h5 or a spec_<split>.h5 file.")
+    parser.add_argument('--output', default=None, help="Convert the file to this path instead of benchmarking.")
+    parser.add_argument('--storage', choices=sorted(STORAGE_DTYPES), default='uint8')
+    parser.add_argument('--compression', default='lzf', help="'lzf', 'gzip' or 'none'.")
+    args = parser.parse_args()
+    compression = None if args.compression == 'none' else args.compression
+
+    if args.output:
+        convert_file(args.input_file, args.output, storage=args.storage, compression=compression)
+        print(f"{args.input_file} converted to {args.output} ({args.storage}, {args.compression})")
+    else:
+        options = [('float32', None), ('float32', 'lzf'), ('float16', None), ('float16', 'lzf'),
+                   ('uint8', None), ('uint8', 'lzf'), ('uint8', 'gzip')]
+        print(f"{'storage':<9}{'codec':<7}{'MB':>9}{'single/s':>11}{'batched/s':>11}{'max err (dB)':>14}")
+        for result in benchmark(args.input_file, options):
+            print(f"{result['storage']:<9}{result['compression']:<7}{result['bytes'] / 1e6:>9.2f}"
+                  f"{result['single_per_s']:>11.0f}{result['batch_per_s']:>11.0f}{result['max_error_db']:>14.3f}")
@@ -1,48 +1,138 @@
 import h5py
-import pandas as pd
 import numpy as np
+from track_index import TrackIndex
+from spec_storage import create_spectrogram_dataset
 
-# Load IDs from the CSV files
-train_ids = pd.read_csv('/Users/elcachorrohumano/workspace/MusicNN/data/train/train.csv')['id'].astype(str).tolist()
-test_ids = pd.read_csv('/Users/elcachorrohumano/workspace/MusicNN/data/test/test.csv')['id'].astype(str).tolist()
-validation_ids = pd.read_csv('/Users/elcachorrohumano/workspace/MusicNN/data/validation/validation.csv')['id'].astype(str).tolist()
-
-# Load spectrogram data from the HDF5 file
-with h5py.File('/Users/elcachorrohumano/workspace/MusicNN/data/spectrograms.h5', 'r') as f:
-    spectrograms = f['spectrograms'][:]
-    labels = f['labels'][:]
-    song_names = f['song_names'][:]
-    song_ids = f['song_ids'][:].astype(str)  # Convert song_ids to string for matching
-
-# Create Boolean masks for train, test, and validation sets
-train_mask = np.isin(song_ids, train_ids)
-test_mask = np.isin(song_ids, test_ids)
-validation_mask = np.isin(song_ids, validation_ids)
-
-# Convert song_ids to np.string_ type for HDF5 compatibility
-song_ids_str_train = np.array(song_ids[train_mask], dtype=np.string_)
-song_ids_str_test = np.array(song_ids[test_mask], dtype=np.string_)
-song_ids_str_validation = np.array(song_ids[validation_mask], dtype=np.string_)
-
-# Write train data to spec_train.h5
-with h5py.File('/Users/elcachorrohumano/workspace/MusicNN/data/train/spec_train.h5', 'w') as f_train:
-    f_train.create_dataset('spectrograms', data=spectrograms[train_mask])
-    f_train.create_dataset('labels', data=labels[train_mask])
-    f_train.create_dataset('song_names', data=song_names[train_mask], dtype=h5py.string_dtype(encoding='utf-8'))
-    f_train.create_dataset('song_ids', data=song_ids_str_train)  # Using np.string_ for compatibility
-
-# Write test data to spec_test.h5
-with h5py.File('/Users/elcachorrohumano/workspace/MusicNN/data/test/spec_test.h5', 'w') as f_test:
-    f_test.create_dataset('spectrograms', data=spectrograms[test_mask])
-    f_test.create_dataset('labels', data=labels[test_mask])
-    f_test.create_dataset('song_names', data=song_names[test_mask], dtype=h5py.string_dtype(encoding='utf-8'))
-    f_test.create_dataset('song_ids', data=song_ids_str_test)  # Using np.string_ for compatibility
-
-# Write validation data to spec_validation.h5
-with h5py.File('/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5', 'w') as f_validation:
-    f_validation.create_dataset('spectrograms', data=spectrograms[validation_mask])
-    f_validation.create_dataset('labels', data=labels[validation_mask])
-    f_validation.create_dataset('song_names', data=song_names[validation_mask], dtype=h5py.string_dtype(encoding='utf-8'))
-    f_validation.create_dataset('song_ids', data=song_ids_str_validation)  # Using np.string_ for compatibility
-
-print("Train, test, and validation HDF5 files created successfully.")
+# Paths
+master_file = '/Users/elcachorrohumano/workspace/MusicNN/data/spectrograms.h5'
+splits = {
+    'train': ('/Users/elcachorrohumano/workspace/MusicNN/data/train/train.csv',
+              '/Users/elcachorrohumano/workspace/MusicNN/data/train/spec_train.h5'),
+    'test': ('/Users/elcachorrohumano/workspace/MusicNN/data/test/test.csv',
+             '/Users/elcachorrohumano/workspace/MusicNN/data/test/spec_test.h5'),
+    'validation': ('/Users/elcachorrohumano/workspace/MusicNN/data/validation/validation.csv',
+                   '/Users/elcachorrohumano/workspace/MusicNN/data/validation/spec_validation.h5'),
+}
+
+# 'chunked' copies the rows into the split files, 'virtual' writes split files that point at the master file,
+# 'index' only stores the row indices of each split in the master file
+mode = 'chunked'
+
+# Number of spectrograms held in memory at a time by the chunked mode
+chunk_rows = 256
+
+# Function to find the rows of the master file that belong to each split
+def split_rows(song_ids, split_csvs):
+    rows = {}
+    for name, csv_file in split_csvs.items():
+        rows[name] = np.flatnonzero(TrackIndex.from_csv(csv_file).contains(song_ids))
+    return rows
+
+# Function to copy the song names and IDs of a split (small string columns)
+def write_name_columns(f_split, master, rows):
+    f_split.create_dataset('song_names', data=master['song_names'][:][rows], dtype=h5py.string_dtype(encoding='utf-8'))
+    # Song IDs are stored as fixed-length byte strings for compatibility
+    song_ids = master['song_ids'][:].astype(str)[rows]
+    f_split.create_dataset('song_ids', data=np.array(song_ids, dtype=np.bytes_))
+
+# Function to stream the spectrograms of every split into its own file, `chunk_rows` rows at a time
+def write_splits_chunked(master_file, rows, output_files, chunk_rows=256):
+    """
+    Copies the rows of each split into spec_<split>.h5 with bounded memory.
+
+    The master file is read once, in blocks of `chunk_rows` spectrograms, and each block is scattered
+    into the preallocated split datasets. Only one block is held in memory, whatever the corpus size.
+    A row listed by several splits is copied into each of them.
+    The split files keep the storage type, quantization attributes and codec of the master file.
+    """
+    with h5py.File(master_file, 'r') as master:
+        spectrograms = master['spectrograms']
+        sample_shape = spectrograms.shape[1:]
+        # Split membership as one mask over the master rows per split (the splits may share rows)
+        members = []
+        for name in output_files:
+            mask = np.zeros(len(spectrograms), dtype=bool)
+            mask[rows[name]] = True
+            members.append(mask)
+
+        split_files = []
+        for name, output_file in output_files.items():
+            f_split = h5py.File(output_file, 'w')
+            create_spectrogram_dataset(f_split, (len(rows[name]),) + sample_shape,
+                                       storage=spectrograms.attrs.get('storage', 'float32'),
+                                       compression=spectrograms.compression)
+            f_split.create_dataset('labels', data=master['labels'][:][rows[name]])
+            write_name_columns(f_split, master, rows[name])
+            split_files.append(f_split)
+
+        try:
+            offsets = [0] * len(split_files)
+            for start in range(0, len(spectrograms), chunk_rows):
+                block = spectrograms[start:start + chunk_rows]
+                for code, f_split in enumerate(split_files):
+                    selected = block[members[code][start:start + chunk_rows]]
+                    if len(selected):
+                        f_split['spectrograms'][offsets[code]:offsets[code] + len(selected)] = selected
+                        offsets[code] += len(selected)
+        finally:
+            for f_split in split_files:
+                f_split.close()
+
+# Function to split a sorted array of row indices into contiguous runs of (output_start, source_start, length)
+def contiguous_runs(rows):
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    lengths = np.diff(np.concatenate((starts, [len(rows)])))
+    return list(zip(starts, rows[starts], lengths))
+
+# Function to write split files whose spectrograms and labels are HDF5 virtual datasets over the master file
+def write_splits_virtual(master_file, rows, output_files):
+    """
+    Writes spec_<split>.h5 files without copying any spectrogram.
+
+    `spectrograms` and `labels` are virtual datasets mapping each contiguous run of split rows onto
+    the master file, so the existing loaders read them unchanged. The small string columns are copied.
+    The master file must stay at the same path for the split files to resolve.
+    """
+    with h5py.File(master_file, 'r') as master:
+        for name, output_file in output_files.items():
+            with h5py.File(output_file, 'w') as f_split:
+                for dataset_name in ('spectrograms', 'labels'):
+                    dataset = master[dataset_name]
+                    layout = h5py.VirtualLayout(shape=(len(rows[name]),) + dataset.shape[1:], dtype=dataset.dtype)
+                    source = h5py.VirtualSource(master_file, dataset_name, shape=dataset.shape)
+                    for out_start, source_start, length in contiguous_runs(rows[name]):
+                        layout[out_start:out_start + length] = source[source_start:source_start + length]
+                    f_split.create_virtual_dataset(dataset_name, layout).attrs.update(dataset.attrs)
+                write_name_columns(f_split, master, rows[name])
+
+# Function to store the row indices of each split in the master file instead of writing split files
+def write_split_indices(master_file, rows):
+    with h5py.File(master_file, 'a') as master:
+        group = master.require_group('splits')
+        for name, split in rows.items():
+            if name in group:
+                del group[name]
+            group.create_dataset(name, data=split.astype(np.int64))
+
+
+if __name__ == '__main__':
+    with h5py.File(master_file, 'r') as f:
+        song_ids = f['song_ids'][:].astype(str)  # Convert song_ids to string for matching
+
+    rows = split_rows(song_ids, {name: csv_file for name, (csv_file, _) in splits.items()})
+    output_files = {name: output_file for name, (_, output_file) in splits.items()}
+
+    if mode == 'chunked':
+        write_splits_chunked(master_file, rows, output_files, chunk_rows=chunk_rows)
+        print("Train, test, and validation HDF5 files created successfully.")
+    elif mode == 'virtual':
+        write_splits_virtual(master_file, rows, output_files)
+        print("Train, test, and validation virtual HDF5 files created successfully.")
+    elif mode == 'index':
+        write_split_indices(master_file, rows)
+        print(f"Train, test, and validation row indices stored under 'splits' in {master_file}")
+    else:
+        raise ValueError(f"Unknown split mode: {mode}")
@@ -0,0 +1,215 @@
+import io
+import os
+import sys
+import time
+import queue
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from mp3_to_spec import get_spectrogram, SpectrogramWriter
+from track_index import TrackIndex
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'extract'))
+from spotify_client import SpotifyClient
+from response_cache import ResponseCache
+from e_audio_from_csv import get_track_previews, TRACKS_PER_REQUEST
+
+# Paths
+csv_file = '/Users/elcachorrohumano/workspace/MusicNN/data/tracks_audio_features_with_names.csv'
+output_file = '/Users/elcachorrohumano/workspace/MusicNN/data/spectrograms.h5'
+response_cache_file = '/Users/elcachorrohumano/workspace/MusicNN/data/spotify_cache.sqlite'
+
+# Folder to also keep the downloaded MP3s in (<folder>/<like>/<id>.mp3), None to keep them only in memory
+mp3_dir = None
+
+# Number of downloads in flight, decoding processes (None uses every core) and downloaded clips waiting to be decoded
+download_workers = 8
+n_workers = None
+queue_size = 32
+
+# How the spectrograms are stored: 'float32', 'float16' or 'uint8' (see spec_storage.py), and the HDF5 codec
+storage = 'float32'
+compression = None
+
+# Marks the end of the download stage in the queue
+_DONE = object()
+
+
+# Function to download a preview into memory, optionally saving it as an MP3 as well
+def fetch_preview(session, preview_url, file_path=None):
+    response = session.get(preview_url, timeout=30)
+    response.raise_for_status()
+    data = response.content
+    if file_path is not None:
+        # Write to a temporary file first, so a partial download never looks complete
+        with open(file_path + '.part', 'wb') as file:
+            file.write(data)
+        os.replace(file_path + '.part', file_path)
+    return data
+
+# Function run in the decoding processes: decodes the bytes of one clip and returns the error instead of raising it
+def _decode_one(track_id, data, n_mels, sr, hop_length):
+    try:
+        return track_id, get_spectrogram(io.BytesIO(data), n_mels=n_mels, sr=sr, hop_length=hop_length), None
+    except Exception as e:
+        return track_id, None, f"{type(e).__name__}: {e}"
+
+# Function run on a thread: looks up the previews and downloads them into the bounded queue
+def _download_stage(client, track_ids, labels, clips, mp3_dir, download_workers, timings):
+    start = time.perf_counter()
+
+    def download(track_id, preview_url):
+        file_path = os.path.join(mp3_dir, str(labels[track_id]), f"{track_id}.mp3") if mp3_dir else None
+        try:
+            clips.put((track_id, fetch_preview(client.session, preview_url, file_path), None))
+        except Exception as e:
+            clips.put((track_id, None, f"Download failed: {e}"))
+
+    looked_up = 0
+    try:
+        with ThreadPoolExecutor(max_workers=download_workers) as executor:
+            for i in range(0, len(track_ids), TRACKS_PER_REQUEST):
+                batch = track_ids[i:i + TRACKS_PER_REQUEST]
+                preview_urls = get_track_previews(client, batch)
+                looked_up = i + len(batch)
+                for track_id in batch:
+                    if track_id not in preview_urls:
+                        clips.put((track_id, None, "Track lookup failed"))
+                    elif not preview_urls[track_id]:
+                        clips.put((track_id, None, "No preview available"))
+                    else:
+                        executor.submit(download, track_id, preview_urls[track_id])
+    except Exception as e:
+        # The lookups stopped (network error, exhausted credentials...): record every track left as failed
+        # and hand the error to ingest_previews, which raises it once the file is written
+        timings['error'] = e
+        for track_id in track_ids[looked_up:]:
+            clips.put((track_id, None, f"Track lookup aborted: {type(e).__name__}: {e}"))
+    finally:
+        timings['download'] = time.perf_counter() - start
+        clips.put(_DONE)
+
+# Function to decode the clips of the queue as they arrive and yield (track_id, spectrogram, error)
+def _decode_stage(clips, mel_args, n_workers, timings):
+    busy = 0.0
+    if n_workers == 1:
+        while (item := clips.get()) is not _DONE:
+            track_id, data, error = item
+            if error is not None:
+                yield item
+                continue
+            start = time.perf_counter()
+            result = _decode_one(track_id, data, *mel_args)
+            busy += time.perf_counter() - start
+            yield result
+        timings['decode'] = busy
+        return
+
+    # Keep each worker on one BLAS/OpenMP thread so the processes don't oversubscribe the cores
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMBA_NUM_THREADS'):
+        os.environ.setdefault(var, '1')
+
+    context = mp.get_context('spawn')
+    max_pending = 2 * n_workers
+    pending = deque()
+    executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context)
+    try:
+        finished = False
+        while not finished or pending:
+            # Keep the workers busy, but take clips from the queue only as fast as they are decoded
+            while not finished and len(pending) < max_pending:
+                item = clips.get()
+                if item is _DONE:
+                    finished = True
+                elif item[2] is not None:
+                    yield item
+                else:
+                    pending.append((item[0], item[1], executor.submit(_decode_one, *item[:2], *mel_args)))
+            if not pending:
+                continue
+
+            track_id, data, future = pending.popleft()
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                # The clip took its worker down: mark it as failed and resubmit the others to a new pool
+                executor.shutdown(wait=False, cancel_futures=True)
+                yield track_id, None, "Worker process crashed while decoding the clip"
+                executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context)
+                pending = deque((tid, clip, executor.submit(_decode_one, tid, clip, *mel_args))
+                                for tid, clip, _ in pending)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+# Main function to stream the previews of the CSV straight into the HDF5 spectrogram file
+def ingest_previews(csv_file, output_file, client, n_mels=128, sr=22050, hop_length=512, length_policy='truncate',
+                    length=None, mp3_dir=None, download_workers=8, n_workers=None, queue_size=32, storage='float32',
+                    compression=None):
+    """
+    Downloads the preview of every track of the CSV and turns it into a mel spectrogram, without
+    going through MP3 files on disk.
+
+    Downloads run on `download_workers` threads and put the preview bytes into a queue holding at
+    most `queue_size` clips. The clips are decoded in memory as they arrive, on `n_workers` processes,
+    and streamed into `output_file` with the same layout as mp3_to_spec.py. When the queue is full
+    the downloads wait, so memory stays bounded and the run takes about as long as the slower of the
+    two stages. Clips are stored in the order they finish, not in the order of the CSV. With
+    `mp3_dir`, the previews are also saved to <mp3_dir>/<like>/<id>.mp3. `storage` and `compression`
+    are passed to SpectrogramWriter, as in mp3_to_spec.build_spectrograms.
+
+    If the track lookups fail partway, the tracks that were not looked up are recorded in
+    'failed_files' and the error is raised after the file is written.
+    """
+    # A track listed twice is ingested once, with the label and name of its first row
+    df = pd.read_csv(csv_file).drop_duplicates('id')
+    tracks = TrackIndex(df)
+    track_ids = list(df['id'])
+    labels = dict(zip(df['id'], df['like']))
+    if mp3_dir:
+        for label in set(labels.values()):
+            os.makedirs(os.path.join(mp3_dir, str(label)), exist_ok=True)
+
+    n_workers = n_workers or os.cpu_count()
+    clips = queue.Queue(maxsize=queue_size)
+    timings = {}
+    start = time.perf_counter()
+    downloader = threading.Thread(target=_download_stage, daemon=True,
+                                  args=(client, track_ids, labels, clips, mp3_dir, download_workers, timings))
+    downloader.start()
+
+    with SpectrogramWriter(output_file, n_mels=n_mels, storage=storage, compression=compression) as writer:
+        for track_id, spectrogram, error in _decode_stage(clips, (n_mels, sr, hop_length), n_workers, timings):
+            if error is not None:
+                print(f"Skipping {track_id}: {error}")
+                writer.record_failure(track_id, error)
+                continue
+            writer.append(spectrogram, labels[track_id], tracks.get(track_id, 'track_name', ''), track_id)
+            if len(writer) % 100 == 0:
+                print(f"Processed {len(writer)} clips so far...")
+
+        n_frames = writer.finalize(length_policy, length)
+        print(f"{len(writer)} spectrograms stored with {n_frames} frames each ({length_policy})")
+        if writer.failed_files:
+            print(f"{len(writer.failed_files)} tracks could not be ingested, see 'failed_files' in {output_file}")
+    downloader.join()
+
+    elapsed = time.perf_counter() - start
+    stages = f"downloads {timings['download']:.1f}s"
+    if 'decode' in timings:
+        stages += f", decoding {timings['decode']:.1f}s"
+    print(f"Ingested {len(track_ids)} tracks in {elapsed:.1f}s ({stages})")
+    if 'error' in timings:
+        raise RuntimeError(f"Track lookups stopped early, {output_file} is incomplete") from timings['error']
+
+
+if __name__ == '__main__':
+    from spotify_secrets import e_secrets, l_secrets, v_secrets
+
+    client = SpotifyClient([e_secrets, l_secrets, v_secrets], pool_size=download_workers,
+                           cache=ResponseCache(response_cache_file))
+    ingest_previews(csv_file, output_file, client, mp3_dir=mp3_dir, download_workers=download_workers,
+                    n_workers=n_workers, queue_size=queue_size, storage=storage, compression=compression)
+    print(f"Spectrograms, labels, song names, and IDs saved to {output_file}")
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+# Default metadata file the index is built from
+csv_file = '/Users/elcachorrohumano/workspace/MusicNN/data/tracks_audio_features_with_names.csv'
+
+
+class TrackIndex:
+    """
+    Track metadata indexed by Spotify track ID.
+
+    The table is hashed once, so single lookups are O(1) and bulk joins are one vectorized
+    `get_indexer` call instead of a pandas scan or `np.isin` per query. Duplicated IDs keep
+    their first row, which is the row a `df[df['id'] == song_id]` lookup used to return.
+    """
+
+    def __init__(self, df, id_column='id'):
+        df = df.drop_duplicates(subset=id_column, keep='first').reset_index(drop=True)
+        self.df = df
+        self.ids = pd.Index(df[id_column].astype(str))
+        self._positions = {track_id: position for position, track_id in enumerate(self.ids)}
+
+    @classmethod
+    def from_csv(cls, csv_file=csv_file, id_column='id'):
+        return cls(pd.read_csv(csv_file), id_column=id_column)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, track_id):
+        return track_id in self._positions
+
+    def position(self, track_id):
+        """Returns the row of a track ID, or -1 if it is not in the index."""
+        return self._positions.get(track_id, -1)
+
+    def get(self, track_id, column, default=None):
+        position = self._positions.get(track_id)
+        if position is None:
+            return default
+        return self.df[column].iat[position]
+
+    def positions(self, track_ids):
+        """Returns the rows of many track IDs at once (-1 where an ID is missing)."""
+        return self.ids.get_indexer(np.asarray(track_ids).astype(str))
+
+    def contains(self, track_ids):
+        """Returns a boolean mask telling which of `track_ids` are in the index."""
+        return self.positions(track_ids) >= 0
+
+    def take(self, track_ids, column, default=None):
+        """Returns `column` for many track IDs at once, with `default` where an ID is missing."""
+        positions = self.positions(track_ids)
+        found = positions >= 0
+        column_values = self.df[column].to_numpy()
+        if found.all():
+            return column_values[positions]
+        values = np.full(len(positions), default, dtype=object)
+        values[found] = column_values[positions[found]]
+        return values